@@ -0,0 +1,258 @@
+# Reproducible benchmarks for the sending engine, runnable without network access.
+#
+#   python benchmarks/bench.py engine [--leads 1000 100000 1000000] [--attachment-kb 0 1024] [--concurrency 1 4 16]
+#                                     [--servers 2] [--latency DATA=0.01] [--error RCPT=0.001:550]
+#                                     [--personalized] [--body-repeat 20] [--retry-delay 0.01]
+#   python benchmarks/bench.py micro
+#
+# "engine" starts one stub SMTP server process per simulated account (see stub_smtp.py) and runs
+# a full campaign per combination of lead count, attachment size and concurrency, each in a fresh
+# process so peak RSS and CPU time belong to that run alone. "micro" times the hot helpers.
+# Retries and circuit cooldowns start at --retry-delay seconds instead of a minute or more, so runs
+# with --error measure sending rather than backoff sleeps.
+# --json FILE saves the results; --baseline FILE prints the change against a saved run.
+import os
+import sys
+import json
+import time
+import shutil
+import timeit
+import signal
+import argparse
+import resource
+import tempfile
+import itertools
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+def start_stub_servers(count, latency, errors, cert_dir):
+    servers = []
+    for index in range(count):
+        command = [sys.executable, os.path.join(BENCH_DIR, 'stub_smtp.py'), '--cert-dir', cert_dir, '--seed', str(index)]
+        command += [arg for value in latency for arg in ('--latency', value)]
+        command += [arg for value in errors for arg in ('--error', value)]
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+        line = process.stdout.readline()
+        if not line.startswith('listening on '):
+            raise RuntimeError('stub SMTP server failed to start')
+        servers.append((process, int(line.rsplit(':', 1)[1])))
+    return servers
+
+def stop_stub_servers(servers):
+    for process, _ in servers:
+        process.terminate()
+    for process, _ in servers:
+        process.wait()
+
+def write_leads(path, count, personalized=False):
+    # Personalized runs read a CSV with a first_name column for the merge field
+    with open(path, 'w', encoding='utf-8') as f:
+        if personalized:
+            f.write('email,first_name\n')
+        for start in range(0, count, 100000):
+            rows = range(start, min(start + 100000, count))
+            if personalized:
+                f.write(''.join(f"lead{i}@example.com,Name{i}\n" for i in rows))
+            else:
+                f.write(''.join(f"lead{i}@example.com\n" for i in rows))
+
+# One engine run; executed in a child process (bench.py run-case) so its resource usage is isolated
+def run_case(case):
+    from smscore import (
+        CampaignListener, CampaignSender, AsyncCampaignSender, LeadSource, LogWriter, MessageTemplate, check_leads
+    )
+
+    class Listener(CampaignListener):
+        def on_finished(self, success, message):
+            self.result = (success, message)
+
+    workdir = case['workdir']
+    os.chdir(workdir)
+    personalized = case['personalized']
+    leads_path = os.path.join(workdir, f"leads_{case['leads']}.{'csv' if personalized else 'txt'}")
+    if not os.path.exists(leads_path):
+        write_leads(leads_path, case['leads'], personalized)
+    attachments = []
+    if case['attachment_kb']:
+        attachment_path = os.path.join(workdir, f"attachment_{case['attachment_kb']}kb.bin")
+        with open(attachment_path, 'wb') as f:
+            f.write(os.urandom(case['attachment_kb'] * 1024))
+        attachments.append(attachment_path)
+
+    smtp_details = [
+        {'host': '127.0.0.1', 'port': port, 'username': f"bench{index}", 'password': 'bench',
+         'from_email': f"bench{index}@example.com", 'sender_name': 'Bench', 'max_per_hour': 0}
+        for index, port in enumerate(case['ports'])
+    ]
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.perf_counter()
+
+    subject = 'Benchmark for {{first_name}}' if personalized else 'Benchmark'
+    message_text = ('<p>Hello {{first_name}}, this is a benchmark message</p>' if personalized else
+                    '<p>Hello, this is a benchmark message</p>') * case['body_repeat']
+    leads, _ = check_leads(LeadSource(leads_path), MessageTemplate.merge_fields(subject, message_text))
+    checked = time.perf_counter()
+
+    log_writer = LogWriter(os.path.join(workdir, 'email_logs.db'))
+    log_writer.start()
+    listener = Listener()
+    arguments = dict(
+        smtp_details=smtp_details, message_text=message_text, leads=leads,
+        rotate_count=1, subject=subject, speed_value=10 ** 9, speed_unit='minute', attachments=attachments,
+        suppression_path=os.path.join(workdir, 'suppression.db'),
+        attachment_cache_path=os.path.join(workdir, 'attachment_cache'), log_writer=log_writer, listener=listener,
+        retry_options={'base_delay': case['retry_delay'], 'max_delay': case['retry_delay'] * 8},
+        breaker_options={'cooldown': case['retry_delay'], 'max_cooldown': case['retry_delay'] * 8}
+    )
+    if case['concurrency'] > 1:
+        sender = AsyncCampaignSender(max_in_flight=case['concurrency'], **arguments)
+    else:
+        sender = CampaignSender(**arguments)
+    sender.run()
+    log_writer.close()
+    finished = time.perf_counter()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+
+    snapshot = sender.metrics.snapshot()
+    send = snapshot['phases'].get('send', {})
+    cpu = (usage.ru_utime - usage_before.ru_utime) + (usage.ru_stime - usage_before.ru_stime)
+    return {
+        'sent': snapshot['messages'],
+        'errors': snapshot['errors'],
+        'result': listener.result[1],
+        'check_s': checked - started,
+        'send_s': finished - checked,
+        'messages_per_sec': snapshot['messages'] / (finished - checked) if finished > checked else 0.0,
+        'p50_ms': send.get('p50_ms', 0.0),
+        'p95_ms': send.get('p95_ms', 0.0),
+        'p99_ms': send.get('p99_ms', 0.0),
+        'cpu_s': cpu,
+        'cpu_percent': 100 * cpu / (finished - started) if finished > started else 0.0,
+        'peak_rss_mb': usage.ru_maxrss / 1024,  # ru_maxrss is in KiB on Linux
+    }
+
+def case_name(case):
+    name = f"leads={case['leads']} attachment={case['attachment_kb']}KB concurrency={case['concurrency']}"
+    return name + ' personalized' if case['personalized'] else name
+
+def run_engine(args):
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='smsbench_') as workdir:
+        servers = start_stub_servers(args.servers, args.latency, args.error, workdir)
+        try:
+            for leads, attachment_kb, concurrency in itertools.product(args.leads, args.attachment_kb, args.concurrency):
+                case = {'leads': leads, 'attachment_kb': attachment_kb, 'concurrency': concurrency,
+                        'personalized': args.personalized, 'body_repeat': args.body_repeat, 'retry_delay': args.retry_delay,
+                        'ports': [port for _, port in servers], 'workdir': workdir}
+                completed = subprocess.run([sys.executable, os.path.abspath(__file__), 'run-case', json.dumps(case)],
+                                           stdout=subprocess.PIPE, text=True, check=True)
+                result = json.loads(completed.stdout.strip().splitlines()[-1])
+                results[case_name(case)] = result
+                print(f"{case_name(case)}: {result['messages_per_sec']:.0f} msg/s, "
+                      f"p50/p95/p99 {result['p50_ms']:.2f}/{result['p95_ms']:.2f}/{result['p99_ms']:.2f} ms, "
+                      f"lead check {result['check_s']:.2f}s, CPU {result['cpu_s']:.1f}s ({result['cpu_percent']:.0f}%), "
+                      f"peak RSS {result['peak_rss_mb']:.0f} MB, errors {result['errors'] or 0}", flush=True)
+        finally:
+            stop_stub_servers(servers)
+    return results
+
+def time_per_call(function, repeat=5):
+    # Best of several timeit runs, each long enough (about 0.2s) to be stable
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+def run_micro(args):
+    import pandas as pd
+    from smscore import check_spam, append_gateway, append_gateway_bulk, LeadChecker, MessageTemplate, AttachmentCache
+
+    message = ('Hello, your order has shipped and will arrive on Tuesday. ' * 40).strip()
+    numbers = pd.Series([f"+1 (555) {i // 10000:03d}-{i % 10000:04d}" for i in range(100000)], dtype=str)
+    leads = [f"lead{i}@example.com" for i in range(100000)]
+    with tempfile.NamedTemporaryFile(suffix='.bin', delete=False) as attachment:
+        attachment.write(os.urandom(1024 * 1024))
+    cache = AttachmentCache(tempfile.mkdtemp(prefix='bench_cache_'))
+    template = MessageTemplate('Benchmark', message, [])
+    personalized = MessageTemplate('Hello {{first_name}}', 'Dear {{first_name}}, account {{account_id|none}}. ' + message, [])
+    fields = {'first_name': 'Anna', 'account_id': '12345'}
+
+    # Bulk benchmarks are reported per item so they compare directly with the scalar versions
+    benchmarks = [
+        ('check_spam', lambda: check_spam(message), 1),
+        ('append_gateway', lambda: append_gateway('+1 (555) 123-4567', 'United States', 'Verizon'), 1),
+        ('append_gateway_bulk (per number)', lambda: append_gateway_bulk(numbers, 'United States', 'Verizon'), len(numbers)),
+        ('LeadChecker.iter_valid (per lead)', lambda: list(LeadChecker().iter_valid(leads)), len(leads)),
+        ('MessageTemplate build', lambda: MessageTemplate('Benchmark', message, []), 1),
+        ('MessageTemplate build, 1 MB attachment', lambda: MessageTemplate('Benchmark', message, [attachment.name]), 1),
+        ('MessageTemplate build, 1 MB attachment cached',
+         lambda: MessageTemplate('Benchmark', message, [attachment.name], cache), 1),
+        ('MessageTemplate.render', lambda: template.render('Bench <bench@example.com>', 'lead@example.com'), 1),
+        ('MessageTemplate.render, merge fields', lambda: personalized.render('Bench <bench@example.com>', 'lead@example.com', fields), 1),
+    ]
+    results = {}
+    try:
+        for name, function, items in benchmarks:
+            seconds = time_per_call(function) / items
+            results[name] = {'us_per_op': seconds * 1e6, 'ops_per_sec': 1 / seconds}
+            print(f"{name}: {seconds * 1e6:.3f} us/op ({1 / seconds:,.0f} ops/s)", flush=True)
+    finally:
+        os.remove(attachment.name)
+        shutil.rmtree(cache.directory)
+    return results
+
+# Lower is better for times, sizes and latencies; higher is better for rates
+def compare(results, baseline):
+    print('\nChange against baseline:')
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        changes = []
+        for key in ('messages_per_sec', 'p95_ms', 'cpu_s', 'peak_rss_mb', 'us_per_op'):
+            if key in result and previous.get(key):
+                change = 100 * (result[key] - previous[key]) / previous[key]
+                changes.append(f"{key} {change:+.1f}%")
+        print(f"{name}: {', '.join(changes)}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sending engine benchmarks against a local stub SMTP server.')
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+
+    engine = subparsers.add_parser('engine', help='full campaigns against stub SMTP servers')
+    engine.add_argument('--leads', type=int, nargs='+', default=[1000, 100000, 1000000])
+    engine.add_argument('--attachment-kb', type=int, nargs='+', default=[0, 1024])
+    engine.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    engine.add_argument('--servers', type=int, default=2, help='stub servers (SMTP accounts) to rotate over')
+    engine.add_argument('--personalized', action='store_true', help='CSV leads with a merge field in subject and body')
+    engine.add_argument('--body-repeat', type=int, default=20, help='HTML paragraphs in the message body')
+    engine.add_argument('--latency', action='append', default=[], metavar='CMD=SECONDS', help='passed to stub_smtp.py')
+    engine.add_argument('--error', action='append', default=[], metavar='CMD=RATE:CODE', help='passed to stub_smtp.py')
+    engine.add_argument('--retry-delay', type=float, default=0.01, metavar='SECONDS',
+                        help='base retry delay and circuit cooldown')
+    micro = subparsers.add_parser('micro', help='micro-benchmarks of the hot helpers')
+    for subparser in (engine, micro):
+        subparser.add_argument('--json', help='save results to this file')
+        subparser.add_argument('--baseline', help='compare with results saved by an earlier --json run')
+    run_one = subparsers.add_parser('run-case')
+    run_one.add_argument('case')
+    args = parser.parse_args(argv)
+
+    if args.mode == 'run-case':
+        print(json.dumps(run_case(json.loads(args.case))))
+        return 0
+
+    # Terminating the benchmark still stops the stub servers
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+    results = run_engine(args) if args.mode == 'engine' else run_micro(args)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            compare(results, json.load(f))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,236 @@
+# Local SMTP server for benchmarks: speaks just enough ESMTP (EHLO, STARTTLS, AUTH, MAIL, RCPT,
+# DATA, RSET, NOOP, QUIT) for smtplib and the sending engine, accepts and discards everything.
+#
+#   python benchmarks/stub_smtp.py --port 2525 --latency DATA=0.02 --error RCPT=0.01:550 --error DATA=0.001:421
+#
+# --latency CMD=SECONDS delays the reply to CMD (CONNECT delays the greeting).
+# --error CMD=RATE:CODE makes that fraction of CMD replies fail with CODE; 421 also drops the connection.
+# --implicit-tls starts TLS before the greeting, like port 465, instead of offering STARTTLS.
+# The certificate is self-signed and generated with the openssl command line tool.
+import os
+import sys
+import ssl
+import random
+import signal
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import socketserver
+
+ERROR_TEXT = {
+    421: 'Service not available, closing transmission channel',
+    450: 'Mailbox unavailable',
+    451: 'Local error in processing',
+    452: 'Insufficient system storage',
+    535: 'Authentication credentials invalid',
+    550: 'No such user',
+    552: 'Message size exceeds fixed maximum',
+    554: 'Transaction failed',
+}
+
+def make_certificate(directory):
+    cert_path = os.path.join(directory, 'stub_cert.pem')
+    key_path = os.path.join(directory, 'stub_key.pem')
+    if not (os.path.exists(cert_path) and os.path.exists(key_path)):
+        subprocess.run(
+            ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '30', '-subj', '/CN=localhost',
+             '-keyout', key_path, '-out', cert_path],
+            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+    return cert_path, key_path
+
+class StubSMTPHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        # Like real MTAs; otherwise replies written after TLS 1.3 session tickets wait for a delayed ACK
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.tls = False
+        if self.server.implicit_tls:
+            try:
+                self.wrap_tls()
+            except OSError:
+                pass  # Failed handshake; handle() closes the connection
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+        self.wfile.flush()
+
+    def command_reply(self, command, ok_reply):
+        # Latency and injected failures are looked up per command verb
+        server = self.server
+        delay = server.latency.get(command)
+        if delay:
+            server.sleep(delay)
+        injected = server.errors.get(command)
+        if injected and server.random() < injected[0]:
+            code = injected[1]
+            server.count('error_' + str(code))
+            self.reply(f"{code} {ERROR_TEXT.get(code, 'Injected failure')}")
+            return code != 421
+        self.reply(ok_reply)
+        return True
+
+    def start_tls(self):
+        self.reply('220 Ready to start TLS')
+        self.wrap_tls()
+
+    def wrap_tls(self):
+        self.connection = self.server.tls_context.wrap_socket(self.connection, server_side=True)
+        self.rfile = self.connection.makefile('rb')
+        self.wfile = self.connection.makefile('wb')
+        self.tls = True
+        self.server.count('tls_resumed' if self.connection.session_reused else 'tls_full')
+
+    def read_data(self):
+        size = 0
+        for line in self.rfile:
+            if line == b'.\r\n':
+                return size
+            size += len(line)
+        return None
+
+    def handle(self):
+        if self.server.implicit_tls and not self.tls:
+            return
+        if not self.command_reply('CONNECT', '220 stub ESMTP ready'):
+            return
+        self.server.count('connections')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+
+            if verb in ('EHLO', 'HELO'):
+                # Greeting line first, then one extension per line; the whole reply goes out in one write
+                lines = ['stub', 'AUTH PLAIN LOGIN', 'SIZE 52428800', '8BITMIME']
+                if self.server.tls_context and not self.tls:
+                    lines.append('STARTTLS')
+                ok = self.command_reply(verb, '\r\n'.join(f"250-{line}" for line in lines[:-1]) + f"\r\n250 {lines[-1]}")
+            elif verb == 'STARTTLS' and self.server.tls_context and not self.tls:
+                self.start_tls()
+                ok = True
+            elif verb == 'AUTH':
+                if command.upper().startswith('AUTH LOGIN'):
+                    # Username (unless sent with the command) and password prompts; the answers are not checked
+                    prompts = ['334 UGFzc3dvcmQ6']
+                    if len(command.split()) < 3:
+                        prompts.insert(0, '334 VXNlcm5hbWU6')
+                    for prompt in prompts:
+                        self.reply(prompt)
+                        if not self.rfile.readline():
+                            return
+                ok = self.command_reply('AUTH', '235 Authentication successful')
+            elif verb in ('MAIL', 'RCPT'):
+                ok = self.command_reply(verb, '250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                size = self.read_data()
+                if size is None:
+                    return
+                ok = self.command_reply('DATA', '250 OK queued')
+                if ok:
+                    self.server.count('messages')
+                    self.server.count('bytes', size)
+            elif verb in ('RSET', 'NOOP'):
+                ok = self.command_reply(verb, '250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+                ok = True
+            if not ok:
+                return
+
+class StubSMTPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=None, errors=None, tls=True, cert_dir=None, seed=None,
+                 implicit_tls=False):
+        super().__init__(address, StubSMTPHandler)
+        self.latency = latency or {}
+        self.errors = errors or {}  # Command -> (rate, code)
+        self.implicit_tls = implicit_tls
+        self.tls_context = None
+        if tls or implicit_tls:
+            cert_path, key_path = make_certificate(cert_dir or tempfile.gettempdir())
+            self.tls_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self.tls_context.load_cert_chain(cert_path, key_path)
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+        self.rng = random.Random(seed)
+        self.stopped = threading.Event()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def random(self):
+        with self.stats_lock:
+            return self.rng.random()
+
+    def sleep(self, seconds):
+        self.stopped.wait(seconds)
+
+    def count(self, name, amount=1):
+        with self.stats_lock:
+            self.stats[name] = self.stats.get(name, 0) + amount
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.shutdown()
+        self.server_close()
+
+def parse_latency(values):
+    latency = {}
+    for value in values:
+        command, seconds = value.split('=', 1)
+        latency[command.upper()] = float(seconds)
+    return latency
+
+def parse_errors(values):
+    errors = {}
+    for value in values:
+        command, spec = value.split('=', 1)
+        rate, code = spec.split(':', 1)
+        errors[command.upper()] = (float(rate), int(code))
+    return errors
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Stub SMTP server for benchmarks.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0, help='0 picks a free port')
+    parser.add_argument('--latency', action='append', default=[], metavar='CMD=SECONDS')
+    parser.add_argument('--error', action='append', default=[], metavar='CMD=RATE:CODE')
+    parser.add_argument('--no-tls', action='store_true', help='do not offer STARTTLS')
+    parser.add_argument('--implicit-tls', action='store_true', help='TLS from the first byte, like port 465')
+    parser.add_argument('--cert-dir', help='where the self-signed certificate is kept (default: temp dir)')
+    parser.add_argument('--seed', type=int, help='seed for error injection')
+    args = parser.parse_args(argv)
+
+    server = StubSMTPServer((args.host, args.port), parse_latency(args.latency), parse_errors(args.error),
+                            tls=not args.no_tls, cert_dir=args.cert_dir, seed=args.seed,
+                            implicit_tls=args.implicit_tls)
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.stopped.set())
+    server.start()
+    # The first line tells a parent process which port was picked
+    print(f"listening on {args.host}:{server.port}", flush=True)
+    try:
+        server.stopped.wait()
+    except KeyboardInterrupt:
+        pass
+    server.stop()
+    print(' '.join(f"{name}={value}" for name, value in sorted(server.stats.items())), flush=True)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,22 +1,20 @@
 import sys
-import pandas as pd
-import smtplib
-import json
 import os
-from PyQt5.QtWidgets import QApplication, QMainWindow, QPushButton, QLabel, QLineEdit, QVBoxLayout, QHBoxLayout, QWidget, QTextEdit, QCheckBox, QFileDialog, QProgressBar, QFormLayout, QListWidget, QListWidgetItem, QInputDialog, QMessageBox, QRadioButton, QButtonGroup, QComboBox, QTabWidget, QScrollArea
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.application import MIMEApplication
+import itertools
+import functools
+from PyQt5.QtWidgets import QApplication, QMainWindow, QPushButton, QLabel, QLineEdit, QVBoxLayout, QHBoxLayout, QWidget, QTextEdit, QCheckBox, QFileDialog, QProgressBar, QFormLayout, QListWidget, QListWidgetItem, QInputDialog, QMessageBox, QRadioButton, QButtonGroup, QComboBox, QTabWidget, QScrollArea, QListView, QTableView, QHeaderView, QTableWidget, QTableWidgetItem
+from PyQt5.QtCore import Qt, QThread, QTimer, pyqtSignal, QAbstractListModel, QAbstractTableModel, QModelIndex
+from PyQt5.QtGui import QColor
+from smscore import (
+    check_spam, gateway_registry, LeadSource, SuppressionStore, CampaignJournal, LogStore, LogWriter,
+    CampaignSender, AsyncCampaignSender, SimulatedCampaignSender, MessageTemplate, Attachment, append_gateway_to_file, append_gateway_to_list, check_leads,
+    export_logs, load_smtp_details, save_smtp_details, check_attachments, format_size, TLS_VERSIONS,
+    verify_smtp, verify_smtp_all, CampaignQueue, remove_temporary_leads, discard_leads
+)
 
 # Hardcoded license key
 LICENSE_KEY = 'oladdev'
 
-# Helper Function to Check Spammy Words
-def check_spam(text):
-    spam_words = ["free", "win", "cash", "prize", "winner", "guaranteed"]
-    return any(word in text.lower() for word in spam_words)
-
 # Function to Check License
 def check_license():
     license_input, ok = QInputDialog.getText(None, 'License Check', 'Enter license key:', QLineEdit.Password)
@@ -24,155 +22,264 @@ def check_license():
         QMessageBox.critical(None, 'License Error', 'Invalid license key. Exiting application.')
         sys.exit(1)
 
-# Function to format and append SMS gateway
-def append_gateway(number, country, gateway):
-    # Remove country code prefix based on the selected country
-    if country == 'United States' and number.startswith('+1'):
-        number = number[2:]  # Remove +1
-    elif country == 'United Kingdom' and number.startswith('+44'):
-        number = number[3:]  # Remove +44
-    elif country == 'Canada' and number.startswith('+1'):
-        number = number[2:]  # Remove +1
-    elif country == 'Australia' and number.startswith('+61'):
-        number = number[3:]  # Remove +61
-    
-    # Remove any spaces, hyphens, or plus signs
-    number = number.replace('+', '').replace('-', '').replace(' ', '').strip()
-
-    # Append the correct SMS gateway
-    if country == 'United States':
-        if gateway == 'AT&T':
-            return f"{number}@txt.att.net"
-        elif gateway == 'T-Mobile':
-            return f"{number}@tmomail.net"
-        elif gateway == 'Verizon':
-            return f"{number}@vtext.com"
-        elif gateway == 'Sprint':
-            return f"{number}@messaging.sprintpcs.com"
-    elif country == 'United Kingdom':
-        if gateway == 'Vodafone UK':
-            return f"{number}@vodafone.net"
-        elif gateway == 'O2':
-            return f"{number}@o2.co.uk"
-    elif country == 'Canada':
-        if gateway == 'Rogers':
-            return f"{number}@pcs.rogers.com"
-        elif gateway == 'Bell':
-            return f"{number}@txt.bell.ca"
-        elif gateway == 'Telus':
-            return f"{number}@msg.telus.com"
-        elif gateway == 'Fido':
-            return f"{number}@fido.ca"
-    elif country == 'Australia':
-        if gateway == 'Telstra':
-            return f"{number}@sms.telstra.com"
-        elif gateway == 'Optus':
-            return f"{number}@optusmobile.com.au"
-        elif gateway == 'Vodafone AU':
-            return f"{number}@vfa.com.au"
-    return None
-
-# Worker Thread for Sending SMS/Email
+# Worker Thread for Sending SMS/Email; the sending itself is done by a smscore.CampaignSender
 class MessageSenderThread(QThread):
     progress = pyqtSignal(int)
     status_update = pyqtSignal(str)
     finished = pyqtSignal(bool, str)
-    log_update = pyqtSignal(dict)
+    # Per-recipient events are coalesced and emitted in batches
+    status_batch = pyqtSignal(list)
+    log_batch = pyqtSignal(list)
+    rate_update = pyqtSignal(float)  # Achieved messages per minute
+    metrics_update = pyqtSignal(dict)  # SendMetrics snapshot, about once a second
+
+    sender_class = CampaignSender
+
+    def __init__(self, *args, parent=None, **kwargs):
+        super().__init__(parent)
+        self.sender = self.sender_class(*args, listener=self, **kwargs)
+
+    @property
+    def paused(self):
+        return self.sender.paused
+
+    def run(self):
+        # Whatever the engine doesn't handle (a locked database, an unwritable journal) still ends
+        # the run, so the GUI gets its controls back
+        try:
+            self.sender.run()
+        except Exception as e:
+            self.on_finished(False, f"Campaign failed: {e}")
+
+    def pause(self):
+        self.sender.pause()
+
+    def resume(self):
+        self.sender.resume()
+
+    def stop(self):
+        self.sender.stop()
+
+    # CampaignListener interface, called on this thread and forwarded to the GUI as signals
+    def on_progress(self, percent):
+        self.progress.emit(percent)
+
+    def on_status(self, message):
+        self.status_update.emit(message)
+
+    def on_status_batch(self, messages):
+        self.status_batch.emit(messages)
 
-    def __init__(self, smtp_details, message_text, leads, rotate_count, subject, speed_value, speed_unit, attachments, parent=None):
+    def on_log_batch(self, entries):
+        self.log_batch.emit(entries)
+
+    def on_rate(self, per_minute):
+        self.rate_update.emit(per_minute)
+
+    def on_metrics(self, snapshot):
+        self.metrics_update.emit(snapshot)
+
+    def on_finished(self, success, message):
+        self.finished.emit(success, message)
+
+# Same signals, driven by the asyncio engine with several messages in flight per SMTP server
+class AsyncMessageSenderThread(MessageSenderThread):
+    sender_class = AsyncCampaignSender
+
+# Dry run: the same pipeline against a simulated transport on a virtual clock, nothing is sent
+class SimulatedMessageSenderThread(MessageSenderThread):
+    sender_class = SimulatedCampaignSender
+
+# List model that pulls preview rows from a lead source only as the view scrolls
+class LeadPreviewModel(QAbstractListModel):
+    def __init__(self, source, limit=10000, batch_size=500, parent=None):
+        super().__init__(parent)
+        self.leads = iter(source)
+        self.limit = limit
+        self.batch_size = batch_size
+        self.rows = []
+        self.exhausted = False
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            return self.rows[index.row()]
+        return None
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and not self.exhausted and len(self.rows) < self.limit
+
+    def fetchMore(self, parent):
+        batch = list(itertools.islice(self.leads, min(self.batch_size, self.limit - len(self.rows))))
+        if not batch:
+            self.exhausted = True
+            return
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(batch) - 1)
+        self.rows.extend(batch)
+        self.endInsertRows()
+
+# Table model over a fixed-size ring buffer; once full, the oldest rows are dropped
+class RingBufferModel(QAbstractTableModel):
+    def __init__(self, headers, capacity=10000, parent=None):
+        super().__init__(parent)
+        self.headers = headers
+        self.capacity = capacity
+        self.buffer = [None] * capacity
+        self.start = 0
+        self.size = 0
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.size
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            return self.buffer[(self.start + index.row()) % self.capacity][index.column()]
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return None
+
+    def append_rows(self, rows):
+        rows = rows[-self.capacity:]
+        overflow = self.size + len(rows) - self.capacity
+        if overflow > 0:
+            self.beginRemoveRows(QModelIndex(), 0, overflow - 1)
+            self.start = (self.start + overflow) % self.capacity
+            self.size -= overflow
+            self.endRemoveRows()
+        if not rows:
+            return
+        self.beginInsertRows(QModelIndex(), self.size, self.size + len(rows) - 1)
+        for row in rows:
+            self.buffer[(self.start + self.size) % self.capacity] = row
+            self.size += 1
+        self.endInsertRows()
+
+    def clear(self):
+        self.beginResetModel()
+        self.buffer = [None] * self.capacity
+        self.start = 0
+        self.size = 0
+        self.endResetModel()
+
+# Counts the leads of a file source without blocking the GUI
+class LeadCountThread(QThread):
+    counted = pyqtSignal(object, int)
+
+    def __init__(self, source, parent=None):
+        super().__init__(parent)
+        self.source = source
+
+    def run(self):
+        try:
+            count = len(self.source)
+        except Exception:
+            count = -1
+        self.counted.emit(self.source, count)
+
+# Appends a gateway to a whole lead list in pandas chunks, off the GUI thread
+class GatewayAppendThread(QThread):
+    done = pyqtSignal(object)  # LeadSource for uploaded files, text for typed leads
+    failed = pyqtSignal(str)
+    processed = pyqtSignal(int)
+
+    def __init__(self, leads, country, gateway, parent=None):
         super().__init__(parent)
-        self.smtp_details = smtp_details
-        self.message_text = message_text
         self.leads = leads
-        self.rotate_count = rotate_count
-        self.subject = subject
-        self.speed_value = speed_value
-        self.speed_unit = speed_unit
-        self.attachments = attachments
-        self.paused = False
+        self.country = country
+        self.gateway = gateway
 
     def run(self):
-        success_count = 0
-        failed_count = 0
-        total_leads = len(self.leads)
-        index = 0
-
-        # Calculate sending limits based on speed
-        if self.speed_unit == 'hour':
-            send_limit = self.speed_value
-            sleep_time = 3600  # 1 hour
-        else:
-            send_limit = self.speed_value
-            sleep_time = 60  # 1 minute
+        try:
+            if isinstance(self.leads, LeadSource):
+                self.done.emit(append_gateway_to_file(self.leads, self.country, self.gateway, self.processed.emit))
+            else:
+                self.done.emit('\n'.join(append_gateway_to_list(self.leads, self.country, self.gateway)))
+        except Exception as e:
+            self.failed.emit(str(e))
 
-        while index < total_leads:
-            if self.isInterruptionRequested():
-                break
+# Runs the pre-send lead check off the GUI thread
+class LeadCheckThread(QThread):
+    checked = pyqtSignal(object, dict, object)  # Checked leads, stats and the request they were checked for
+    failed = pyqtSignal(str)
 
-            if self.paused:
-                self.msleep(1000)  # Sleep for a while if paused
-                continue
+    def __init__(self, leads, merge_fields=None, request=None, parent=None):
+        super().__init__(parent)
+        self.leads = leads
+        self.merge_fields = merge_fields
+        self.request = request
 
-            lead = self.leads[index]
-            smtp_index = (index // self.rotate_count) % len(self.smtp_details)
-            smtp = self.smtp_details[smtp_index]
+    def run(self):
+        try:
+            leads, stats = check_leads(self.leads, self.merge_fields)
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        self.checked.emit(leads, stats, self.request)
 
+# Imports an opt-out file into the suppression store without blocking the GUI
+class SuppressionImportThread(QThread):
+    imported = pyqtSignal(int, int)  # New addresses, total suppressed
+    failed = pyqtSignal(str)
+
+    def __init__(self, path, parent=None):
+        super().__init__(parent)
+        self.path = path
+
+    def run(self):
+        try:
+            store = SuppressionStore()
             try:
-                with smtplib.SMTP(smtp['host'], smtp['port']) as server:
-                    server.starttls()
-                    server.login(smtp['username'], smtp['password'])
-
-                    msg = MIMEMultipart()
-                    msg['From'] = smtp['from_email']
-                    msg['To'] = lead
-                    msg['Subject'] = self.subject
-
-                    msg.attach(MIMEText(self.message_text, 'html'))
-
-                    # Attach files
-                    for attachment in self.attachments:
-                        with open(attachment, "rb") as file:
-                            part = MIMEApplication(file.read(), Name=os.path.basename(attachment))
-                        part['Content-Disposition'] = f'attachment; filename="{os.path.basename(attachment)}"'
-                        msg.attach(part)
-
-                    server.sendmail(smtp['from_email'], lead, msg.as_string())
-
-                success_count += 1
-                status = f"Sent to {lead}: Success with {smtp['username']} ({smtp['sender_name']})"
-                self.status_update.emit(status)
-                self.log_update.emit({
-                    'recipient': lead,
-                    'status': 'Success',
-                    'smtp': f"{smtp['username']} ({smtp['sender_name']})",
-                    'message': status
-                })
-            except Exception as e:
-                status = f"Failed to send to {lead}: {e} with {smtp['username']} ({smtp['sender_name']})"
-                self.status_update.emit(status)
-                self.log_update.emit({
-                    'recipient': lead,
-                    'status': 'Failed',
-                    'smtp': f"{smtp['username']} ({smtp['sender_name']})",
-                    'message': status
-                })
-                failed_count += 1
-
-            index += 1
-            self.progress.emit(int((index) / total_leads * 100))
-
-            # Check if we have reached the send limit for this time unit
-            if index % send_limit == 0:
-                self.status_update.emit(f"Reached send limit of {send_limit}. Waiting for the next time slot...")
-                self.msleep(sleep_time * 1000)  # Sleep for 1 hour or 1 minute, based on the selected speed
-
-        self.finished.emit(True, f"Completed: {success_count} sent, {failed_count} failed")
+                added = store.import_leads(LeadSource(self.path))
+                total = store.count()
+            finally:
+                store.close()
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        self.imported.emit(added, total)
 
-    def pause(self):
-        self.paused = True
+# Checks SMTP servers off the GUI thread, all at once; results arrive one by one as each server answers
+class SMTPVerifyThread(QThread):
+    verified = pyqtSignal(object, dict)  # The smtp_details entry, smscore.verify_smtp result
 
-    def resume(self):
-        self.paused = False
+    def __init__(self, servers, send_test=False, timeout=15, parent=None):
+        super().__init__(parent)
+        self.servers = servers
+        self.send_test = send_test
+        self.timeout = timeout
+
+    def run(self):
+        if self.send_test:
+            for smtp in self.servers:
+                self.verified.emit(smtp, verify_smtp(smtp, self.timeout, send_test=True))
+        else:
+            verify_smtp_all(self.servers, self.timeout, on_result=self.verified.emit)
+
+# Streams filtered log rows to a CSV or JSONL file
+class LogExportThread(QThread):
+    exported = pyqtSignal(int)
+    failed = pyqtSignal(str)
+
+    def __init__(self, path, filters, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.filters = filters
+
+    def run(self):
+        try:
+            count = export_logs(self.path, self.filters)
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        self.exported.emit(count)
 
 class SMSApp(QMainWindow):
     def __init__(self):
@@ -180,6 +287,13 @@ class SMSApp(QMainWindow):
         self.setWindowTitle("SMTP to SMS/Email Sender")
         self.setGeometry(100, 100, 1200, 600)
         self.smtp_details = self.load_smtp_details()  # Load saved SMTP details
+        self.sending = False  # A single campaign (Start Sending, Resume Campaign or Dry Run) is running
+        self.checking = False  # Leads are being checked for a run or for the queue
+        self.lead_source = None  # Set while an uploaded file replaces the typed leads
+        self.log_writer = LogWriter()
+        self.log_writer.start()
+        # Queued campaigns share one SMTP pool and the per-SMTP rate limits among themselves
+        self.campaign_queue = CampaignQueue(self.smtp_details, log_writer=self.log_writer)
         self.initUI()
 
     def initUI(self):
@@ -190,14 +304,20 @@ class SMSApp(QMainWindow):
         self.smtp_tab = QWidget()
         self.message_tab = QWidget()
         self.logs_tab = QWidget()
+        self.metrics_tab = QWidget()
+        self.campaigns_tab = QWidget()
 
         self.tab_widget.addTab(self.smtp_tab, "SMTP Settings")
         self.tab_widget.addTab(self.message_tab, "Message Sender")
+        self.tab_widget.addTab(self.campaigns_tab, "Campaign Queue")
         self.tab_widget.addTab(self.logs_tab, "Email Logs")
+        self.tab_widget.addTab(self.metrics_tab, "Metrics")
 
         self.setup_smtp_tab()
         self.setup_message_tab()
+        self.setup_campaigns_tab()
         self.setup_logs_tab()
+        self.setup_metrics_tab()
 
         # Footer
         footer = QLabel('<a href="https://bit.ly/hiolad">Developed by Olad Synergy Solutions</a>')
@@ -218,6 +338,19 @@ class SMSApp(QMainWindow):
         self.smtp_password = QLineEdit()
         self.from_email = QLineEdit()
         self.sender_name = QLineEdit()
+        self.max_per_hour = QLineEdit()
+        self.max_per_hour.setPlaceholderText('Optional, e.g. 500')
+        # Encryption settings; the defaults match what a plain starttls() did
+        self.smtp_security = QComboBox()
+        self.smtp_security.addItem('Auto (SSL/TLS on port 465, otherwise STARTTLS)', '')
+        self.smtp_security.addItem('STARTTLS', 'starttls')
+        self.smtp_security.addItem('SSL/TLS', 'ssl')
+        self.smtp_min_tls = QComboBox()
+        self.smtp_min_tls.addItem('Default', '')
+        for version in TLS_VERSIONS:
+            self.smtp_min_tls.addItem(f'TLS {version}', version)
+        self.smtp_ciphers = QLineEdit()
+        self.smtp_ciphers.setPlaceholderText('Optional OpenSSL cipher list, e.g. ECDHE+AESGCM')
 
         smtp_form_layout.addRow(QLabel('SMTP Host:'), self.smtp_host)
         smtp_form_layout.addRow(QLabel('SMTP Port:'), self.smtp_port)
@@ -225,16 +358,22 @@ class SMSApp(QMainWindow):
         smtp_form_layout.addRow(QLabel('SMTP Password:'), self.smtp_password)
         smtp_form_layout.addRow(QLabel('From Email:'), self.from_email)
         smtp_form_layout.addRow(QLabel('Sender Name:'), self.sender_name)
+        smtp_form_layout.addRow(QLabel('Max Sends per Hour:'), self.max_per_hour)
+        smtp_form_layout.addRow(QLabel('Encryption:'), self.smtp_security)
+        smtp_form_layout.addRow(QLabel('Minimum TLS Version:'), self.smtp_min_tls)
+        smtp_form_layout.addRow(QLabel('Ciphers:'), self.smtp_ciphers)
 
         self.test_add_button = QPushButton('Test AND Add SMTP')
         self.remove_smtp_button = QPushButton('Remove Selected SMTP')
         self.remove_smtp_button.setEnabled(False)
+        self.verify_all_button = QPushButton('Verify All SMTP')
 
         self.test_add_button.setStyleSheet("background-color: blue; color: white;")
         self.remove_smtp_button.setStyleSheet("background-color: red; color: white;")
 
         smtp_form_layout.addWidget(self.test_add_button)
         smtp_form_layout.addWidget(self.remove_smtp_button)
+        smtp_form_layout.addWidget(self.verify_all_button)
 
         layout.addLayout(smtp_form_layout)
 
@@ -242,7 +381,7 @@ class SMSApp(QMainWindow):
         self.smtp_list_widget = QListWidget()
         self.smtp_list_widget.itemSelectionChanged.connect(self.on_smtp_selection_changed)
         for smtp in self.smtp_details:
-            self.smtp_list_widget.addItem(QListWidgetItem(f"{smtp['host']}:{smtp['port']} - {smtp['username']}"))
+            self.smtp_list_widget.addItem(QListWidgetItem(self.smtp_item_text(smtp)))
         layout.addWidget(self.smtp_list_widget)
 
         # Read-only box for SMTP Details
@@ -256,6 +395,7 @@ class SMSApp(QMainWindow):
         # Connections
         self.test_add_button.clicked.connect(self.test_and_add_smtp)
         self.remove_smtp_button.clicked.connect(self.remove_smtp)
+        self.verify_all_button.clicked.connect(self.verify_all_smtp)
 
         # Update the SMTP display
         self.update_smtp_display()
@@ -265,7 +405,7 @@ class SMSApp(QMainWindow):
 
         # Message content
         self.message_text_edit = QTextEdit()
-        self.message_text_edit.setPlaceholderText('Enter SMS/EMAIL content here...')
+        self.message_text_edit.setPlaceholderText('Enter SMS/EMAIL content here... Use {{column}} or {{column|default}} to merge values from a CSV/Excel lead file.')
         layout.addWidget(QLabel('Message Content:'))
         layout.addWidget(self.message_text_edit)
 
@@ -281,16 +421,34 @@ class SMSApp(QMainWindow):
         layout.addWidget(QLabel('Leads:'))
         layout.addWidget(self.leads_text_edit)
 
+        # Preview of an uploaded leads file, rows are only read as the list scrolls
+        self.leads_preview = QListView()
+        self.leads_preview.setUniformItemSizes(True)
+        self.leads_preview.hide()
+        layout.addWidget(self.leads_preview)
+        self.leads_count_label = QLabel()
+        self.leads_count_label.hide()
+        layout.addWidget(self.leads_count_label)
+
         # Upload leads button
+        upload_buttons_layout = QHBoxLayout()
         self.upload_button = QPushButton('Upload Leads')
         self.upload_button.clicked.connect(self.upload_leads)
         self.upload_button.setStyleSheet("background-color: blue; color: white;")
-        layout.addWidget(self.upload_button)
+        self.clear_leads_button = QPushButton('Clear Uploaded Leads')
+        self.clear_leads_button.clicked.connect(self.clear_uploaded_leads)
+        self.clear_leads_button.hide()
+        self.import_optout_button = QPushButton('Import Opt-Out List')
+        self.import_optout_button.clicked.connect(self.import_optout_list)
+        upload_buttons_layout.addWidget(self.upload_button)
+        upload_buttons_layout.addWidget(self.clear_leads_button)
+        upload_buttons_layout.addWidget(self.import_optout_button)
+        layout.addLayout(upload_buttons_layout)
 
         # Country and Gateway Selection
         country_gateway_layout = QHBoxLayout()
         self.country_combo = QComboBox()
-        self.country_combo.addItems(['United States', 'United Kingdom', 'Canada', 'Australia'])
+        self.country_combo.addItems(gateway_registry.country_names())
         self.gateway_combo = QComboBox()
         country_gateway_layout.addWidget(QLabel('Country:'))
         country_gateway_layout.addWidget(self.country_combo)
@@ -312,6 +470,12 @@ class SMSApp(QMainWindow):
         rotation_layout.addWidget(self.rotate_count_checkbox)
         rotation_layout.addWidget(QLabel('SMTP Rotate Count:'))
         rotation_layout.addWidget(self.rotate_count_spinbox)
+        self.concurrency_input = QLineEdit()
+        self.concurrency_input.setText('1')
+        rotation_layout.addWidget(QLabel('Concurrent Sends per SMTP:'))
+        rotation_layout.addWidget(self.concurrency_input)
+        self.profile_checkbox = QCheckBox('Profile this run (cProfile)')
+        rotation_layout.addWidget(self.profile_checkbox)
         layout.addLayout(rotation_layout)
 
         # Speed Selection
@@ -346,12 +510,17 @@ class SMSApp(QMainWindow):
         # Progress bar and buttons
         self.progress_bar = QProgressBar()
         layout.addWidget(self.progress_bar)
+        self.rate_label = QLabel('Actual rate: -')
+        layout.addWidget(self.rate_label)
 
         button_layout = QHBoxLayout()
         self.start_button = QPushButton('Start Sending')
         self.pause_button = QPushButton('Pause')
         self.stop_button = QPushButton('Stop')
         self.clear_button = QPushButton('Clear Progress')
+        self.resume_button = QPushButton('Resume Campaign')
+        self.dry_run_button = QPushButton('Dry Run')
+        self.dry_run_button.setToolTip('Estimate how long the campaign takes with the current settings, without sending')
         self.start_button.setStyleSheet("background-color: red; color: white;")
         self.pause_button.setStyleSheet("background-color: gold; color: black;")
         self.stop_button.setStyleSheet("background-color: red; color: white;")
@@ -362,11 +531,28 @@ class SMSApp(QMainWindow):
         button_layout.addWidget(self.pause_button)
         button_layout.addWidget(self.stop_button)
         button_layout.addWidget(self.clear_button)
+        button_layout.addWidget(self.resume_button)
+        button_layout.addWidget(self.dry_run_button)
         layout.addLayout(button_layout)
 
-        self.progress_box = QTextEdit()
-        self.progress_box.setPlaceholderText('Progress messages will appear here...')
-        self.progress_box.setReadOnly(True)
+        # Queued campaigns run alongside each other, see the Campaign Queue tab
+        queue_layout = QHBoxLayout()
+        self.priority_combo = QComboBox()
+        self.priority_combo.addItems(list(CampaignQueue.PRIORITIES))
+        self.priority_combo.setCurrentText('Normal')
+        self.queue_button = QPushButton('Add to Queue')
+        self.queue_button.setToolTip('Send this campaign alongside other queued campaigns, sharing the SMTP servers')
+        self.queue_button.setStyleSheet("background-color: purple; color: white;")
+        queue_layout.addWidget(QLabel('Queue Priority:'))
+        queue_layout.addWidget(self.priority_combo)
+        queue_layout.addWidget(self.queue_button)
+        layout.addLayout(queue_layout)
+
+        # Progress messages live in a bounded ring buffer so long campaigns don't grow the view
+        self.progress_model = RingBufferModel(['Progress'], parent=self)
+        self.progress_box = QListView()
+        self.progress_box.setUniformItemSizes(True)
+        self.progress_box.setModel(self.progress_model)
         layout.addWidget(self.progress_box)
 
         self.message_tab.setLayout(layout)
@@ -374,7 +560,10 @@ class SMSApp(QMainWindow):
         # Connections
         self.country_combo.currentIndexChanged.connect(self.update_gateway)
         self.append_gateway_button.clicked.connect(self.append_gateway_to_leads)
-        self.start_button.clicked.connect(self.start_sending)
+        self.start_button.clicked.connect(lambda: self.start_sending())
+        self.resume_button.clicked.connect(self.resume_campaign)
+        self.dry_run_button.clicked.connect(lambda: self.start_sending(dry_run=True))
+        self.queue_button.clicked.connect(lambda: self.start_sending(queued=True))
         self.pause_button.clicked.connect(self.toggle_pause_resume)
         self.stop_button.clicked.connect(self.stop_sending)
         self.clear_button.clicked.connect(self.clear_progress)
@@ -383,25 +572,260 @@ class SMSApp(QMainWindow):
 
     def setup_logs_tab(self):
         layout = QVBoxLayout()
+        logs_tabs = QTabWidget()
+        layout.addWidget(logs_tabs)
+
+        # Live view of the current run
+        self.logs_model = RingBufferModel(['Recipient', 'Status', 'SMTP', 'Message'], parent=self)
+        self.logs_table = self.create_logs_table(self.logs_model)
+        logs_tabs.addTab(self.logs_table, 'Live')
+
+        # Searchable history of every run, read page by page from the log store
+        history = QWidget()
+        history_layout = QVBoxLayout()
+        filter_layout = QHBoxLayout()
+        self.log_campaign_filter = QComboBox()
+        self.log_recipient_filter = QLineEdit()
+        self.log_recipient_filter.setPlaceholderText('Recipient starts with...')
+        self.log_status_filter = QComboBox()
+        self.log_status_filter.addItems(['All', 'Success', 'Failed', 'Deferred', 'Skipped'])
+        self.log_smtp_filter = QLineEdit()
+        self.log_smtp_filter.setPlaceholderText('SMTP starts with...')
+        self.log_search_button = QPushButton('Search')
+        filter_layout.addWidget(QLabel('Campaign:'))
+        filter_layout.addWidget(self.log_campaign_filter)
+        filter_layout.addWidget(self.log_recipient_filter)
+        filter_layout.addWidget(QLabel('Status:'))
+        filter_layout.addWidget(self.log_status_filter)
+        filter_layout.addWidget(self.log_smtp_filter)
+        filter_layout.addWidget(self.log_search_button)
+        history_layout.addLayout(filter_layout)
+
+        self.log_page_size = 500
+        self.log_page = 0
+        self.log_total = 0
+        self.log_history_model = RingBufferModel(['Recipient', 'Status', 'SMTP', 'Message'], capacity=self.log_page_size, parent=self)
+        history_layout.addWidget(self.create_logs_table(self.log_history_model))
+
+        paging_layout = QHBoxLayout()
+        self.log_prev_button = QPushButton('Previous')
+        self.log_next_button = QPushButton('Next')
+        self.log_page_label = QLabel()
+        self.log_export_button = QPushButton('Export CSV/JSONL')
+        self.log_prev_button.setEnabled(False)
+        self.log_next_button.setEnabled(False)
+        paging_layout.addWidget(self.log_prev_button)
+        paging_layout.addWidget(self.log_page_label)
+        paging_layout.addWidget(self.log_next_button)
+        paging_layout.addWidget(self.log_export_button)
+        history_layout.addLayout(paging_layout)
+        history.setLayout(history_layout)
+        logs_tabs.addTab(history, 'History')
 
-        self.logs_text_edit = QTextEdit()
-        self.logs_text_edit.setReadOnly(True)
-        self.logs_text_edit.setPlaceholderText('Email logs will appear here...')
+        self.logs_tab.setLayout(layout)
 
-        layout.addWidget(self.logs_text_edit)
+        # Connections
+        self.log_search_button.clicked.connect(self.search_logs)
+        self.log_prev_button.clicked.connect(lambda: self.show_log_page(self.log_page - 1))
+        self.log_next_button.clicked.connect(lambda: self.show_log_page(self.log_page + 1))
+        self.log_export_button.clicked.connect(self.export_logs)
+        logs_tabs.currentChanged.connect(lambda index: index == 1 and self.refresh_log_campaigns())
+
+    def create_logs_table(self, model):
+        table = QTableView()
+        table.setModel(model)
+        table.verticalHeader().hide()
+        table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        table.horizontalHeader().setStretchLastSection(True)
+        return table
+
+    def refresh_log_campaigns(self):
+        current = self.log_campaign_filter.currentText()
+        store = LogStore()
+        try:
+            campaigns = store.campaigns()
+        finally:
+            store.close()
+        self.log_campaign_filter.clear()
+        self.log_campaign_filter.addItems(['All'] + campaigns)
+        self.log_campaign_filter.setCurrentText(current)
+
+    def log_filters(self):
+        campaign = self.log_campaign_filter.currentText()
+        status = self.log_status_filter.currentText()
+        return {
+            'campaign': None if campaign in ('', 'All') else campaign,
+            'recipient': self.log_recipient_filter.text().strip() or None,
+            'status': None if status == 'All' else status,
+            'smtp': self.log_smtp_filter.text().strip() or None,
+        }
+
+    def search_logs(self):
+        store = LogStore()
+        try:
+            self.log_total = store.count(**self.log_filters())
+        finally:
+            store.close()
+        self.show_log_page(0)
+
+    def show_log_page(self, page):
+        pages = max(1, -(-self.log_total // self.log_page_size))
+        self.log_page = min(max(page, 0), pages - 1)
+        store = LogStore()
+        try:
+            rows = store.page(self.log_page_size, self.log_page * self.log_page_size, **self.log_filters())
+        finally:
+            store.close()
+        self.log_history_model.clear()
+        self.log_history_model.append_rows(rows)
+        self.log_page_label.setText(f"Page {self.log_page + 1} of {pages} ({self.log_total} results)")
+        self.log_prev_button.setEnabled(self.log_page > 0)
+        self.log_next_button.setEnabled(self.log_page < pages - 1)
+
+    def export_logs(self):
+        file_path, _ = QFileDialog.getSaveFileName(self, 'Export Logs', 'email_logs.csv', 'CSV Files (*.csv);;JSON Lines (*.jsonl)')
+        if file_path:
+            self.log_export_button.setEnabled(False)
+            self.log_export_thread = LogExportThread(file_path, self.log_filters())
+            self.log_export_thread.exported.connect(self.on_logs_exported)
+            self.log_export_thread.failed.connect(self.on_logs_export_failed)
+            self.log_export_thread.start()
 
-        self.logs_tab.setLayout(layout)
+    def on_logs_exported(self, count):
+        self.log_export_button.setEnabled(True)
+        QMessageBox.information(self, 'Export Logs', f'{count} log entries exported.')
+
+    def on_logs_export_failed(self, error):
+        self.log_export_button.setEnabled(True)
+        QMessageBox.critical(self, 'Export Logs', f'Error exporting logs: {error}')
+
+    def setup_campaigns_tab(self):
+        layout = QVBoxLayout()
+
+        layout.addWidget(QLabel(f'Up to {self.campaign_queue.max_running} campaigns send at a time, higher priority first. '
+                                'When they compete for an SMTP limit, a High campaign gets 4 sends for every 2 of a '
+                                'Normal and 1 of a Low one; a paused or throttled campaign leaves its share to the others.'))
+        self.campaigns_table = QTableWidget(0, 9)
+        self.campaigns_table.setHorizontalHeaderLabels(
+            ['Campaign', 'Priority', 'Status', 'Progress', 'Sent', 'Failed', 'Skipped', 'Rate/min', 'Last message'])
+        self.campaigns_table.setSelectionBehavior(QTableWidget.SelectRows)
+        self.campaigns_table.setSelectionMode(QTableWidget.SingleSelection)
+        self.campaigns_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.campaigns_table.horizontalHeader().setStretchLastSection(True)
+        layout.addWidget(self.campaigns_table)
+        self.campaign_ids = []
+
+        button_layout = QHBoxLayout()
+        self.pause_campaign_button = QPushButton('Pause')
+        self.resume_campaign_button = QPushButton('Resume')
+        self.cancel_campaign_button = QPushButton('Cancel')
+        self.remove_finished_button = QPushButton('Remove Finished')
+        self.pause_campaign_button.setStyleSheet("background-color: gold; color: black;")
+        self.cancel_campaign_button.setStyleSheet("background-color: red; color: white;")
+        self.pause_campaign_button.clicked.connect(lambda: self.control_campaign(self.campaign_queue.pause))
+        self.resume_campaign_button.clicked.connect(lambda: self.control_campaign(self.campaign_queue.resume))
+        self.cancel_campaign_button.clicked.connect(lambda: self.control_campaign(self.campaign_queue.cancel))
+        self.remove_finished_button.clicked.connect(self.remove_finished_campaigns)
+        button_layout.addWidget(self.pause_campaign_button)
+        button_layout.addWidget(self.resume_campaign_button)
+        button_layout.addWidget(self.cancel_campaign_button)
+        button_layout.addWidget(self.remove_finished_button)
+        layout.addLayout(button_layout)
+
+        self.campaigns_tab.setLayout(layout)
+
+        # The queue is polled rather than signalled, a few campaigns at twice a second is cheap
+        self.campaign_timer = QTimer(self)
+        self.campaign_timer.setInterval(500)
+        self.campaign_timer.timeout.connect(self.refresh_campaigns)
+
+    def refresh_campaigns(self):
+        priorities = {weight: name for name, weight in CampaignQueue.PRIORITIES.items()}
+        campaigns = self.campaign_queue.snapshot()
+        self.campaign_ids = [campaign['id'] for campaign in campaigns]
+        self.fill_metrics_table(self.campaigns_table, [
+            (campaign['name'], priorities.get(campaign['priority'], campaign['priority']), campaign['state'],
+             f"{campaign['progress']}%", campaign['sent'], campaign['failed'], campaign['skipped'], campaign['rate'],
+             campaign['message'])
+            for campaign in campaigns
+        ])
+        if not self.campaign_queue.busy():
+            self.campaign_timer.stop()
+
+    def control_campaign(self, action):
+        row = self.campaigns_table.currentRow()
+        if row < 0 or row >= len(self.campaign_ids):
+            QMessageBox.warning(self, 'Campaign Queue', 'Select a campaign first.')
+            return
+        campaign = self.campaign_queue.get(self.campaign_ids[row])
+        if campaign:
+            action(campaign)
+        self.refresh_campaigns()
+
+    def remove_finished_campaigns(self):
+        self.campaign_queue.remove_finished()
+        self.refresh_campaigns()
+
+    def queue_campaign(self, leads, request):
+        settings = request['settings']
+        name = settings['subject'] or f"Campaign {len(self.campaign_queue.campaigns) + 1}"
+        self.campaign_queue.add(name, dict(settings, leads=leads), priority=request['priority'],
+                                sender_class=request['sender_class'])
+        self.add_progress(f"Campaign \"{name}\" added to the queue ({len(leads)} leads).")
+        self.refresh_campaigns()
+        self.campaign_timer.start()
+
+    def setup_metrics_tab(self):
+        layout = QVBoxLayout()
+
+        self.metrics_summary_label = QLabel('No run yet.')
+        layout.addWidget(self.metrics_summary_label)
+
+        layout.addWidget(QLabel('Phase timings:'))
+        self.metrics_phases_table = QTableWidget(0, 6)
+        self.metrics_phases_table.setHorizontalHeaderLabels(['Phase', 'Count', 'Avg ms', 'p50 ms', 'p95 ms', 'p99 ms'])
+        layout.addWidget(self.metrics_phases_table)
+
+        layout.addWidget(QLabel('Send latency per SMTP:'))
+        self.metrics_servers_table = QTableWidget(0, 6)
+        self.metrics_servers_table.setHorizontalHeaderLabels(['SMTP', 'Sent', 'p50 ms', 'p95 ms', 'p99 ms', 'Errors'])
+        layout.addWidget(self.metrics_servers_table)
+
+        self.metrics_errors_label = QLabel()
+        layout.addWidget(self.metrics_errors_label)
+
+        self.metrics_tab.setLayout(layout)
+
+    def fill_metrics_table(self, table, rows):
+        table.setRowCount(len(rows))
+        for row, values in enumerate(rows):
+            for column, value in enumerate(values):
+                text = f"{value:.1f}" if isinstance(value, float) else str(value)
+                table.setItem(row, column, QTableWidgetItem(text))
+
+    def update_metrics(self, snapshot):
+        tls = snapshot['tls']
+        self.metrics_summary_label.setText(
+            f"Elapsed: {snapshot['elapsed']:.0f}s   Sent: {snapshot['messages']}   "
+            f"Messages/sec: {snapshot['messages_per_sec']:.2f}   "
+            f"TLS handshakes: {tls['full']} full, {tls['resumed']} resumed "
+            f"(saves {tls['saved_ms']:.1f} ms per reconnect)")
+        self.fill_metrics_table(self.metrics_phases_table, [
+            (phase, stats['count'], stats['avg_ms'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms'])
+            for phase, stats in snapshot['phases'].items()
+        ])
+        self.fill_metrics_table(self.metrics_servers_table, [
+            (label, stats['count'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms'], stats['errors'])
+            for label, stats in sorted(snapshot['servers'].items())
+        ])
+        errors = ', '.join(f"{code}: {count}" for code, count in sorted(snapshot['errors'].items()))
+        self.metrics_errors_label.setText(f"Errors by code: {errors or 'none'}")
 
     def load_smtp_details(self):
-        try:
-            with open('smtp_details.json', 'r') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            return []
+        return load_smtp_details('smtp_details.json')
 
     def save_smtp_details(self):
-        with open('smtp_details.json', 'w') as f:
-            json.dump(self.smtp_details, f)
+        save_smtp_details(self.smtp_details, 'smtp_details.json')
 
     def test_and_add_smtp(self):
         host = self.smtp_host.text()
@@ -416,32 +840,86 @@ class SMSApp(QMainWindow):
             return
 
         try:
-            with smtplib.SMTP(host, port) as server:
-                server.starttls()
-                server.login(username, password)
-                test_msg = MIMEText('This is a test email.', 'html')
-                test_msg['From'] = from_email
-                test_msg['To'] = from_email
-                test_msg['Subject'] = 'Test Email'
-                server.sendmail(from_email, from_email, test_msg.as_string())
-            
-            new_smtp = {
-                'host': host,
-                'port': port,
-                'username': username,
-                'password': password,
-                'from_email': from_email,
-                'sender_name': sender_name
-            }
-            self.smtp_details.append(new_smtp)
-
-            self.smtp_list_widget.addItem(QListWidgetItem(f"{host}:{port} - {username}"))
-            self.save_smtp_details()
-            self.update_smtp_display()
+            max_per_hour = int(self.max_per_hour.text() or 0)
+        except ValueError:
+            QMessageBox.warning(self, 'Input Error', 'Max sends per hour must be a whole number.')
+            return
 
-            QMessageBox.information(self, 'Success', 'SMTP configuration is correct and added.')
-        except Exception as e:
-            QMessageBox.critical(self, 'SMTP Error', f'Error testing SMTP configuration: {e}')
+        new_smtp = {
+            'host': host,
+            'port': port,
+            'username': username,
+            'password': password,
+            'from_email': from_email,
+            'sender_name': sender_name
+        }
+        if max_per_hour > 0:
+            new_smtp['max_per_hour'] = max_per_hour
+        # Only settings that differ from the defaults are saved
+        for key, value in (('security', self.smtp_security.currentData()), ('min_tls', self.smtp_min_tls.currentData()),
+                           ('ciphers', self.smtp_ciphers.text().strip())):
+            if value:
+                new_smtp[key] = value
+
+        # Connecting, logging in and sending the test email happen on a worker thread, with a timeout
+        self.test_add_button.setEnabled(False)
+        self.smtp_test_thread = SMTPVerifyThread([new_smtp], send_test=True)
+        self.smtp_test_thread.verified.connect(self.on_smtp_tested)
+        self.smtp_test_thread.start()
+
+    def on_smtp_tested(self, new_smtp, result):
+        self.test_add_button.setEnabled(True)
+        if not result['ok']:
+            QMessageBox.critical(self, 'SMTP Error', f"Error testing SMTP configuration: {result['error']}")
+            return
+
+        self.smtp_details.append(new_smtp)
+        item = QListWidgetItem()
+        self.smtp_list_widget.addItem(item)
+        self.show_smtp_health(item, new_smtp, result)
+        self.save_smtp_details()
+        self.update_smtp_display()
+
+        QMessageBox.information(self, 'Success', 'SMTP configuration is correct and added.')
+
+    def verify_all_smtp(self):
+        if not self.smtp_details:
+            QMessageBox.warning(self, 'No SMTP Details', 'There are no SMTP servers to verify.')
+            return
+        self.verify_all_button.setEnabled(False)
+        for row, smtp in enumerate(self.smtp_details):
+            item = self.smtp_list_widget.item(row)
+            item.setText(f"{self.smtp_item_text(smtp)}    checking...")
+            item.setForeground(QColor('gray'))
+        # Every saved server is checked at once; rows update as each one answers
+        self.smtp_verify_thread = SMTPVerifyThread(list(self.smtp_details))
+        self.smtp_verify_thread.verified.connect(self.on_smtp_verified)
+        self.smtp_verify_thread.finished.connect(lambda: self.verify_all_button.setEnabled(True))
+        self.smtp_verify_thread.start()
+
+    def on_smtp_verified(self, smtp, result):
+        # Looked up by identity, since entries may have been removed while the check ran
+        for row, entry in enumerate(self.smtp_details):
+            if entry is smtp:
+                self.show_smtp_health(self.smtp_list_widget.item(row), smtp, result)
+                return
+
+    def smtp_item_text(self, smtp, result=None):
+        text = f"{smtp['host']}:{smtp['port']} - {smtp['username']}"
+        if result is None:
+            return text
+        if not result['ok']:
+            return f"{text}    FAILED: {result['error']}"
+        timings = []
+        if result['connect_ms'] is not None:
+            timings.append(f"connect {result['connect_ms']:.0f} ms")
+        timings.append(f"TLS {result['tls_ms']:.0f} ms{' (resumed)' if result['tls_resumed'] else ''}")
+        timings.append(f"login {result['login_ms']:.0f} ms")
+        return f"{text}    OK: {', '.join(timings)}"
+
+    def show_smtp_health(self, item, smtp, result):
+        item.setText(self.smtp_item_text(smtp, result))
+        item.setForeground(QColor('darkgreen' if result['ok'] else 'red'))
 
     def remove_smtp(self):
         current_item = self.smtp_list_widget.currentItem()
@@ -464,51 +942,143 @@ class SMSApp(QMainWindow):
             self.smtp_display.append(f"Username: {smtp['username']}")
             self.smtp_display.append(f"From Email: {smtp['from_email']}")
             self.smtp_display.append(f"Sender Name: {smtp['sender_name']}")
+            if smtp.get('max_per_hour'):
+                self.smtp_display.append(f"Max Sends per Hour: {smtp['max_per_hour']}")
+            if smtp.get('security'):
+                self.smtp_display.append(f"Encryption: {'SSL/TLS' if smtp['security'] == 'ssl' else 'STARTTLS'}")
+            if smtp.get('min_tls'):
+                self.smtp_display.append(f"Minimum TLS Version: {smtp['min_tls']}")
+            if smtp.get('ciphers'):
+                self.smtp_display.append(f"Ciphers: {smtp['ciphers']}")
             self.smtp_display.append("-" * 30)
 
     def upload_leads(self):
-        file_path, _ = QFileDialog.getOpenFileName(self, 'Open Leads File', '', 'Text Files (*.txt);;All Files (*)')
+        file_path, _ = QFileDialog.getOpenFileName(self, 'Open Leads File', '', 'Lead Files (*.txt *.csv *.xlsx);;Text Files (*.txt);;All Files (*)')
+        if file_path:
+            self.set_lead_source(LeadSource(file_path))
+
+    def set_lead_source(self, source):
+        # Large files are never loaded into the text box; the sender streams them from disk.
+        # A file written by a gateway append is deleted once a newer one replaces it.
+        if self.lead_source and self.lead_source is not source:
+            self.lead_source.discard()
+        self.lead_source = source
+        self.leads_preview.setModel(LeadPreviewModel(source, parent=self))
+        self.leads_text_edit.hide()
+        self.leads_preview.show()
+        self.leads_count_label.setText(f"{os.path.basename(source.path)}: counting leads...")
+        self.leads_count_label.show()
+        self.clear_leads_button.show()
+
+        self.lead_count_thread = LeadCountThread(source)
+        self.lead_count_thread.counted.connect(self.on_leads_counted)
+        self.lead_count_thread.start()
+
+    def on_leads_counted(self, source, count):
+        if source is not self.lead_source:
+            return
+        if count < 0:
+            self.leads_count_label.setText(f"{os.path.basename(source.path)}: could not read leads")
+        else:
+            self.leads_count_label.setText(f"{os.path.basename(source.path)}: {count} leads")
+
+    def clear_uploaded_leads(self):
+        if self.lead_source:
+            self.lead_source.discard()
+        self.lead_source = None
+        self.leads_preview.setModel(None)
+        self.leads_preview.hide()
+        self.leads_count_label.hide()
+        self.clear_leads_button.hide()
+        self.leads_text_edit.show()
+
+    def import_optout_list(self):
+        file_path, _ = QFileDialog.getOpenFileName(self, 'Open Opt-Out File', '', 'Lead Files (*.txt *.csv *.xlsx);;All Files (*)')
         if file_path:
-            with open(file_path, 'r') as file:
-                leads = file.readlines()
-            self.leads_text_edit.setText(''.join(leads))
+            self.import_optout_button.setEnabled(False)
+            self.suppression_import_thread = SuppressionImportThread(file_path)
+            self.suppression_import_thread.imported.connect(self.on_optout_imported)
+            self.suppression_import_thread.failed.connect(self.on_optout_import_failed)
+            self.suppression_import_thread.start()
+
+    def on_optout_imported(self, added, total):
+        self.import_optout_button.setEnabled(True)
+        QMessageBox.information(self, 'Opt-Out List', f'{added} new addresses suppressed ({total} in total).')
+
+    def on_optout_import_failed(self, error):
+        self.import_optout_button.setEnabled(True)
+        QMessageBox.critical(self, 'Opt-Out List', f'Error importing opt-out list: {error}')
 
     def update_gateway(self):
         country = self.country_combo.currentText()
         self.gateway_combo.clear()
-        if country == 'United States':
-            self.gateway_combo.addItems(['AT&T', 'T-Mobile', 'Verizon', 'Sprint'])
-        elif country == 'United Kingdom':
-            self.gateway_combo.addItems(['Vodafone UK', 'O2'])
-        elif country == 'Canada':
-            self.gateway_combo.addItems(['Rogers', 'Bell', 'Telus', 'Fido'])
-        elif country == 'Australia':
-            self.gateway_combo.addItems(['Telstra', 'Optus', 'Vodafone AU'])
+        self.gateway_combo.addItems(gateway_registry.gateway_names(country))
 
     def append_gateway_to_leads(self):
-        leads = self.leads_text_edit.toPlainText().splitlines()
         country = self.country_combo.currentText()
         gateway = self.gateway_combo.currentText()
+        leads = self.lead_source or self.leads_text_edit.toPlainText().splitlines()
+
+        self.append_gateway_button.setEnabled(False)
+        self.gateway_thread = GatewayAppendThread(leads, country, gateway)
+        self.gateway_thread.done.connect(self.on_gateway_appended)
+        self.gateway_thread.failed.connect(self.on_gateway_failed)
+        self.gateway_thread.processed.connect(
+            lambda count: self.leads_count_label.setText(f"Appending gateway: {count} leads processed..."))
+        self.gateway_thread.start()
+
+    def on_gateway_appended(self, result):
+        self.append_gateway_button.setEnabled(True)
+        if isinstance(result, LeadSource):
+            self.set_lead_source(result)
+        else:
+            self.leads_text_edit.setText(result)
 
-        appended_leads = []
-        for lead in leads:
-            appended_lead = append_gateway(lead, country, gateway)
-            if appended_lead:
-                appended_leads.append(appended_lead)
-
-        self.leads_text_edit.setText('\n'.join(appended_leads))
+    def on_gateway_failed(self, error):
+        self.append_gateway_button.setEnabled(True)
+        QMessageBox.critical(self, 'Gateway Error', f'Error appending gateway: {error}')
 
     def add_attachment(self):
         file_path, _ = QFileDialog.getOpenFileName(self, 'Select Attachment', '', 'All Files (*)')
-        if file_path:
-            self.attachment_list.addItem(file_path)
+        if not file_path:
+            return
+        # Checked and hashed now, so a missing or oversized file never gets as far as a send
+        try:
+            attachment = Attachment.load(file_path)
+            check_attachments(self.attachments() + [attachment])
+        except (OSError, ValueError) as e:
+            QMessageBox.critical(self, 'Attachment Error', f'Cannot attach {os.path.basename(file_path)}: {e}')
+            return
+        item = QListWidgetItem(f'{file_path} ({format_size(attachment.size)})')
+        item.setData(Qt.UserRole, attachment)
+        self.attachment_list.addItem(item)
+
+    def attachments(self):
+        return [self.attachment_list.item(i).data(Qt.UserRole) for i in range(self.attachment_list.count())]
 
     def remove_attachment(self):
         current_item = self.attachment_list.currentItem()
         if current_item:
             self.attachment_list.takeItem(self.attachment_list.row(current_item))
 
-    def start_sending(self):
+    def resume_campaign(self):
+        # Resending the same message and leads against an old journal skips everyone already done
+        os.makedirs('campaigns', exist_ok=True)
+        journal_path, _ = QFileDialog.getOpenFileName(self, 'Open Campaign Journal', 'campaigns', 'Campaign Journals (*.journal)')
+        if not journal_path:
+            return
+        try:
+            header = CampaignJournal.read_header(journal_path)
+        except (OSError, ValueError) as e:
+            QMessageBox.critical(self, 'Resume Campaign', f'Error reading campaign journal: {e}')
+            return
+        if header.get('subject') != self.subject_edit.text() and QMessageBox.question(
+                self, 'Resume Campaign',
+                f"This campaign was sent with the subject \"{header.get('subject')}\". Resume it anyway?") != QMessageBox.Yes:
+            return
+        self.start_sending(journal_path)
+
+    def start_sending(self, journal_path=None, dry_run=False, queued=False):
         if not self.smtp_details:
             QMessageBox.warning(self, 'No SMTP Details', 'Please add SMTP details before starting.')
             return
@@ -526,32 +1096,140 @@ class SMSApp(QMainWindow):
         try:
             speed_value = int(self.speed_value_input.text())
         except ValueError:
-            QMessageBox.warning(self, 'Input Error', 'Speed value must be a valid integer.')
+            speed_value = 0
+        if speed_value < 1:
+            QMessageBox.warning(self, 'Input Error', 'Speed value must be a positive integer.')
+            return
+
+        try:
+            max_in_flight = int(self.concurrency_input.text())
+        except ValueError:
+            max_in_flight = 0
+        if max_in_flight < 1:
+            QMessageBox.warning(self, 'Input Error', 'Concurrent sends per SMTP must be a positive integer.')
             return
 
-        attachments = [self.attachment_list.item(i).text() for i in range(self.attachment_list.count())]
+        # Files that changed since they were added are hashed again; the limits apply to what is sent
+        try:
+            attachments = check_attachments(self.attachments())
+        except (OSError, ValueError) as e:
+            QMessageBox.critical(self, 'Attachment Error', f'Error checking attachments: {e}')
+            return
 
-        self.sender_thread = MessageSenderThread(
-            smtp_details=self.smtp_details,
+        settings = dict(
             message_text=self.message_text_edit.toPlainText(),
-            leads=self.leads_text_edit.toPlainText().splitlines(),
             rotate_count=int(self.rotate_count_spinbox.text()),
             subject=self.subject_edit.text(),
             speed_value=speed_value,
             speed_unit=speed_unit,
-            attachments=attachments
+            attachments=attachments,
+            journal_path=journal_path,
+            profile=self.profile_checkbox.isChecked()
         )
 
+        # More than one message in flight per server needs the asyncio engine; a dry run models either.
+        # Queued campaigns run on the queue's threads and report through it, so they use the engines directly.
+        if queued:
+            if max_in_flight > 1:
+                sender_class = functools.partial(AsyncCampaignSender, max_in_flight=max_in_flight)
+            else:
+                sender_class = CampaignSender
+        elif dry_run:
+            sender_class = functools.partial(SimulatedMessageSenderThread, max_in_flight=max_in_flight)
+        elif max_in_flight > 1:
+            sender_class = functools.partial(AsyncMessageSenderThread, max_in_flight=max_in_flight)
+        else:
+            sender_class = MessageSenderThread
+        # Travels with the lead check, so whatever is started or queued meanwhile can't change it
+        request = {
+            'queued': queued,
+            'dry_run': dry_run,
+            'sender_class': sender_class,
+            'settings': settings,
+            'priority': CampaignQueue.PRIORITIES[self.priority_combo.currentText()],
+        }
+
+        # Leads are de-duplicated and validated before the send loop ever sees them
+        self.start_button.setEnabled(False)
+        self.resume_button.setEnabled(False)
+        self.dry_run_button.setEnabled(False)
+        self.queue_button.setEnabled(False)
+        self.checking = True
+        self.add_progress('Checking leads...')
+        self.lead_check_thread = LeadCheckThread(
+            self.lead_source or self.leads_text_edit.toPlainText().splitlines(),
+            MessageTemplate.merge_fields(self.subject_edit.text(), self.message_text_edit.toPlainText()),
+            request
+        )
+        self.lead_check_thread.checked.connect(self.on_leads_checked)
+        self.lead_check_thread.failed.connect(self.on_lead_check_failed)
+        self.lead_check_thread.start()
+
+    def on_leads_checked(self, leads, stats, request):
+        self.checking = False
+        summary = (f"{stats['total']} leads checked: {stats['accepted']} to send, "
+                   f"{stats['duplicates']} duplicates, {stats['invalid']} invalid, "
+                   f"{stats['unknown_gateway']} with an unknown gateway")
+        if stats['missing_fields']:
+            summary += f", {stats['missing_fields']} missing a merge field"
+        summary += '.'
+        self.add_progress(summary)
+        # The checked leads belong to the run they were checked for, or are discarded here if there is none
+        if not stats['accepted']:
+            QMessageBox.warning(self, 'No Leads', 'There are no valid leads to send to.')
+            discard_leads(leads)
+            self.enable_start_buttons()
+            return
+        if request['queued']:
+            if QMessageBox.question(self, 'Queue Campaign', summary + '\n\nAdd this campaign to the queue?') == QMessageBox.Yes:
+                self.queue_campaign(leads, request)
+            else:
+                discard_leads(leads)
+            self.enable_start_buttons()
+            return
+        if not request['dry_run'] and QMessageBox.question(self, 'Start Sending', summary + '\n\nStart sending?') != QMessageBox.Yes:
+            discard_leads(leads)
+            self.enable_start_buttons()
+            return
+
+        # A real run sends through the same SMTP accounts as queued campaigns, so it shares their pool and
+        # per-SMTP limits; a dry run sends nothing and keeps to its own virtual clock
+        settings = request['settings']
+        smtp_details, shared = self.smtp_details, {}
+        if not request['dry_run']:
+            smtp_details, pool, share = self.campaign_queue.attach(settings['speed_value'], settings['speed_unit'],
+                                                                   request['priority'])
+            shared = {'pool': pool, 'rate_limiter': share}
+        self.sender_thread = request['sender_class'](smtp_details=smtp_details, leads=leads,
+                                                     log_writer=self.log_writer, **shared, **settings)
+
         self.sender_thread.progress.connect(self.progress_bar.setValue)
-        self.sender_thread.status_update.connect(self.progress_box.append)
+        self.sender_thread.status_update.connect(self.add_progress)
+        self.sender_thread.status_batch.connect(self.add_progress_batch)
         self.sender_thread.finished.connect(self.on_sending_finished)
-        self.sender_thread.log_update.connect(self.update_logs)
+        self.sender_thread.log_batch.connect(self.update_logs)
+        self.sender_thread.rate_update.connect(self.update_rate)
+        self.sender_thread.metrics_update.connect(self.update_metrics)
         self.sender_thread.start()
+        self.sending = True
 
-        self.start_button.setEnabled(False)
-        self.pause_button.setEnabled(True)
+        self.enable_start_buttons()
+        self.pause_button.setEnabled(not request['dry_run'])
         self.stop_button.setEnabled(True)
 
+    def on_lead_check_failed(self, error):
+        self.checking = False
+        QMessageBox.critical(self, 'Leads Error', f'Error checking leads: {error}')
+        self.enable_start_buttons()
+
+    def enable_start_buttons(self):
+        # Campaigns can be queued any time; the single campaign controls wait until the current run is over.
+        # Only one lead check runs at a time.
+        self.start_button.setEnabled(not self.sending and not self.checking)
+        self.resume_button.setEnabled(not self.sending and not self.checking)
+        self.dry_run_button.setEnabled(not self.sending and not self.checking)
+        self.queue_button.setEnabled(not self.checking)
+
     def toggle_pause_resume(self):
         if self.sender_thread.paused:
             self.sender_thread.resume()
@@ -561,31 +1239,62 @@ class SMSApp(QMainWindow):
             self.pause_button.setText('Resume')
 
     def stop_sending(self):
+        # The worker notices the request within milliseconds and emits finished itself,
+        # so the GUI thread never blocks waiting for it
         if hasattr(self, 'sender_thread'):
-            self.sender_thread.requestInterruption()
-            self.sender_thread.wait()
+            self.sender_thread.stop()
+            self.add_progress('Stopping...')
 
-        self.start_button.setEnabled(True)
         self.pause_button.setEnabled(False)
         self.stop_button.setEnabled(False)
 
+    def add_progress(self, message):
+        self.add_progress_batch([message])
+
+    def add_progress_batch(self, messages):
+        self.progress_model.append_rows([(message,) for message in messages])
+        self.progress_box.scrollToBottom()
+
     def clear_progress(self):
-        self.progress_box.clear()
+        self.progress_model.clear()
         self.progress_bar.setValue(0)
 
     def on_sending_finished(self, success, message):
-        QMessageBox.information(self, 'Sending Completed', message)
-        self.start_button.setEnabled(True)
+        discard_leads(self.sender_thread.sender.leads)
+        self.campaign_queue.detach(self.sender_thread.sender.shared_limiter)
+        self.sending = False
+        dry_run = isinstance(self.sender_thread, SimulatedMessageSenderThread)
+        QMessageBox.information(self, 'Dry Run Completed' if dry_run else 'Sending Completed', message)
+        self.enable_start_buttons()
+        self.pause_button.setText('Pause')
         self.pause_button.setEnabled(False)
         self.stop_button.setEnabled(False)
 
-    def update_logs(self, log_entry):
-        log_text = f"Recipient: {log_entry['recipient']}\n"
-        log_text += f"Status: {log_entry['status']}\n"
-        log_text += f"SMTP: {log_entry['smtp']}\n"
-        log_text += f"Message: {log_entry['message']}\n"
-        log_text += "-" * 50 + "\n"
-        self.logs_text_edit.append(log_text)
+    def update_rate(self, per_minute):
+        if self.per_hour_radio.isChecked():
+            self.rate_label.setText(f"Actual rate: {per_minute * 60:.0f}/hour")
+        else:
+            self.rate_label.setText(f"Actual rate: {per_minute:.1f}/minute")
+
+    def update_logs(self, log_entries):
+        self.logs_model.append_rows([
+            (entry['recipient'], entry['status'], entry['smtp'], entry['message']) for entry in log_entries
+        ])
+        self.logs_table.scrollToBottom()
+
+    def closeEvent(self, event):
+        # Campaigns stop where they are (their journals let them be resumed). Their last log rows are
+        # flushed when their threads end, so those are waited for, for a few seconds, before the log
+        # writer writes out whatever it still has queued.
+        if self.sending:
+            self.sender_thread.stop()
+        self.campaign_queue.stop_all(timeout=10)
+        if hasattr(self, 'sender_thread'):
+            self.sender_thread.wait(10000)
+            self.campaign_queue.detach(self.sender_thread.sender.shared_limiter)
+        self.log_writer.close()
+        remove_temporary_leads()
+        super().closeEvent(event)
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
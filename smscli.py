@@ -0,0 +1,205 @@
+# Runs a campaign without the GUI, e.g. on a server:
+#
+#   python smscli.py campaign.json [--log campaign.log] [--resume campaigns/<id>.journal] [--dry-run]
+#
+# --dry-run sends nothing: it simulates the campaign on a virtual clock and prints the projected
+# duration, the load on each SMTP server and what limits the speed.
+#
+# campaign.json holds the same settings as the Message Sender tab; relative paths are
+# resolved against the campaign file's directory:
+#
+#   {
+#       "smtp_file": "smtp_details.json",      (or "smtp": [ {...}, ... ])
+#       "subject": "Hello {{first_name|there}}",    (merge fields name columns of a CSV/XLSX leads file)
+#       "message_file": "message.txt",         (or "message": "...")
+#       "leads": "leads.csv",
+#       "country": "United States",            (optional, with "gateway")
+#       "gateway": "Verizon",
+#       "attachments": [],
+#       "rotate_count": 1,
+#       "speed_value": 60,
+#       "speed_unit": "minute",
+#       "concurrency": 1
+#   }
+#
+# Entries in the SMTP list may also set "security" ("starttls", or "ssl" for implicit TLS; port 465
+# defaults to "ssl"), "min_tls"/"max_tls" ("1.2", "1.3"), "ciphers" and "verify_tls".
+import sys
+import os
+import json
+import time
+import signal
+import argparse
+from smscore import (
+    check_spam, CampaignListener, CampaignSender, AsyncCampaignSender, SimulatedCampaignSender, LeadSource, LogWriter, MessageTemplate,
+    append_gateway_to_file, check_attachments, check_leads, load_smtp_details, remove_temporary_leads
+)
+
+# Prints the sender's events to stdout and, optionally, to a log file
+class ConsoleListener(CampaignListener):
+    def __init__(self, log_path=None, verbose=False):
+        self.log = open(log_path, 'a', encoding='utf-8') if log_path else None
+        self.verbose = verbose
+        self.last_progress = -1
+        self.success = False
+
+    def write(self, message, to_stdout=True):
+        line = f"{time.strftime('%Y-%m-%d %H:%M:%S')} {message}"
+        if to_stdout:
+            print(line, flush=True)
+        if self.log:
+            self.log.write(line + '\n')
+            self.log.flush()
+
+    def on_progress(self, percent):
+        # Only whole-percent steps, so a long campaign doesn't flood the terminal
+        if percent != self.last_progress:
+            self.last_progress = percent
+            self.write(f"Progress: {percent}%")
+
+    def on_status(self, message):
+        self.write(message)
+
+    def on_status_batch(self, messages):
+        # Per-recipient lines always go to the log file, and to stdout with --verbose
+        for message in messages:
+            self.write(message, self.verbose)
+
+    def on_rate(self, per_minute):
+        if self.verbose:
+            self.write(f"Actual rate: {per_minute:.1f}/minute")
+
+    def on_finished(self, success, message):
+        self.success = success
+        self.write(message)
+
+    def close(self):
+        if self.log:
+            self.log.close()
+
+def load_campaign(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        campaign = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    resolve = lambda p: p if os.path.isabs(p) else os.path.join(base, p)
+
+    if 'smtp' in campaign:
+        smtp_details = campaign['smtp']
+    else:
+        smtp_details = load_smtp_details(resolve(campaign.get('smtp_file', 'smtp_details.json')))
+    if 'message_file' in campaign:
+        with open(resolve(campaign['message_file']), 'r', encoding='utf-8') as f:
+            message_text = f.read()
+    else:
+        message_text = campaign.get('message', '')
+
+    return {
+        'smtp_details': smtp_details,
+        'message_text': message_text,
+        'subject': campaign.get('subject', ''),
+        'leads': LeadSource(resolve(campaign['leads'])),
+        'country': campaign.get('country'),
+        'gateway': campaign.get('gateway'),
+        'attachments': [resolve(p) for p in campaign.get('attachments', [])],
+        'rotate_count': int(campaign.get('rotate_count', 1)),
+        'speed_value': int(campaign.get('speed_value', 60)),
+        'speed_unit': campaign.get('speed_unit', 'minute'),
+        'concurrency': int(campaign.get('concurrency', 1))
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Send an email/SMS campaign without the GUI.')
+    parser.add_argument('campaign', help='campaign settings (JSON)')
+    parser.add_argument('--log', help='append progress and per-recipient results to this file')
+    parser.add_argument('--resume', metavar='JOURNAL', help='resume the campaign recorded in this journal')
+    parser.add_argument('--verbose', action='store_true', help='print every recipient and the send rate')
+    parser.add_argument('--profile', action='store_true', help='write a cProfile dump next to the journal')
+    parser.add_argument('--dry-run', action='store_true', help='estimate duration and server load without sending')
+    args = parser.parse_args(argv)
+
+    try:
+        campaign = load_campaign(args.campaign)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Invalid campaign file: {e}", file=sys.stderr)
+        return 2
+
+    if not campaign['smtp_details']:
+        print('No SMTP details configured.', file=sys.stderr)
+        return 2
+    if check_spam(campaign['message_text']):
+        print('The content contains spammy words.', file=sys.stderr)
+        return 2
+    if campaign['speed_value'] < 1 or campaign['concurrency'] < 1:
+        print('speed_value and concurrency must be positive integers.', file=sys.stderr)
+        return 2
+    # Missing or oversized attachments are reported now rather than when the first message fails
+    try:
+        campaign['attachments'] = check_attachments(campaign['attachments'])
+    except (OSError, ValueError) as e:
+        print(f"Invalid attachment: {e}", file=sys.stderr)
+        return 2
+
+    listener = ConsoleListener(args.log, args.verbose)
+    try:
+        leads = campaign['leads']
+        if campaign['country'] and campaign['gateway']:
+            listener.write(f"Appending {campaign['gateway']} gateway...")
+            leads = append_gateway_to_file(leads, campaign['country'], campaign['gateway'])
+
+        try:
+            leads, stats = check_leads(leads, MessageTemplate.merge_fields(campaign['subject'], campaign['message_text']))
+        except ValueError as e:
+            listener.write(str(e))
+            return 2
+        listener.write(f"{stats['total']} leads checked: {stats['accepted']} to send, {stats['duplicates']} duplicates, "
+                       f"{stats['invalid']} invalid, {stats['unknown_gateway']} with an unknown gateway, "
+                       f"{stats['missing_fields']} missing a merge field.")
+        if not stats['accepted']:
+            return 1
+
+        if args.dry_run:
+            sender_class, extra = SimulatedCampaignSender, {'max_in_flight': campaign['concurrency']}
+        elif campaign['concurrency'] > 1:
+            sender_class, extra = AsyncCampaignSender, {'max_in_flight': campaign['concurrency']}
+        else:
+            sender_class, extra = CampaignSender, {}
+
+        # A dry run logs nothing, so the log store is left alone
+        log_writer = None if args.dry_run else LogWriter()
+        if log_writer:
+            log_writer.start()
+        sender = sender_class(
+            smtp_details=campaign['smtp_details'],
+            message_text=campaign['message_text'],
+            leads=leads,
+            rotate_count=campaign['rotate_count'],
+            subject=campaign['subject'],
+            speed_value=campaign['speed_value'],
+            speed_unit=campaign['speed_unit'],
+            attachments=campaign['attachments'],
+            journal_path=args.resume,
+            log_writer=log_writer,
+            profile=args.profile,
+            listener=listener,
+            **extra
+        )
+        if not args.dry_run:
+            listener.write(f"Campaign journal: {sender.journal_path}")
+
+        # Ctrl+C stops after the message in flight; the journal lets --resume pick up from there
+        signal.signal(signal.SIGINT, lambda signum, frame: sender.stop())
+        try:
+            sender.run()
+        except Exception as e:
+            listener.on_finished(False, f"Campaign failed: {e}")
+        finally:
+            if log_writer:
+                log_writer.close()
+        return 0 if listener.success else 1
+    finally:
+        # The gateway append and the lead check write temporary copies of the leads
+        remove_temporary_leads()
+        listener.close()
+
+if __name__ == '__main__':
+    sys.exit(main())
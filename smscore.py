@@ -0,0 +1,2643 @@
+# Sending core shared by the GUI (smsapp.py) and the command line (smscli.py).
+# Nothing here imports Qt, and heavy modules (pandas, openpyxl, asyncio, email.mime)
+# are only imported when a feature needs them, so both front ends start quickly.
+import smtplib
+import ssl
+import socket
+import json
+import os
+import threading
+import time
+import itertools
+import sqlite3
+import re
+import tempfile
+import uuid
+import queue
+import csv
+import math
+import heapq
+import binascii
+import hashlib
+import html
+import mmap
+import random
+import contextlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Helper Function to Check Spammy Words
+def check_spam(text):
+    spam_words = ["free", "win", "cash", "prize", "winner", "guaranteed"]
+    return any(word in text.lower() for word in spam_words)
+
+# Countries, their dialling prefixes and carrier gateway domains, loaded from gateways.json
+class GatewayRegistry:
+    def __init__(self, countries):
+        self.countries = countries
+
+    @classmethod
+    def load(cls, path=None):
+        path = path or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gateways.json')
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def country_names(self):
+        return list(self.countries)
+
+    def gateway_names(self, country):
+        return list(self.countries.get(country, {}).get('gateways', {}))
+
+    def prefix(self, country):
+        return self.countries.get(country, {}).get('prefix', '')
+
+    def domain(self, country, gateway):
+        return self.countries.get(country, {}).get('gateways', {}).get(gateway)
+
+    def domains(self):
+        return {domain for country in self.countries.values() for domain in country.get('gateways', {}).values()}
+
+gateway_registry = GatewayRegistry.load()
+
+# Function to format and append SMS gateway
+def append_gateway(number, country, gateway, registry=None):
+    registry = registry or gateway_registry
+    domain = registry.domain(country, gateway)
+    if domain is None:
+        return None
+
+    # Remove country code prefix based on the selected country
+    number = number.strip()
+    prefix = registry.prefix(country)
+    if prefix and number.startswith(prefix):
+        number = number[len(prefix):]
+
+    # Remove spaces, hyphens, plus signs and any other punctuation
+    number = re.sub(r'\D', '', number)
+    return f"{number}@{domain}" if number else None
+
+# Same normalization as append_gateway, applied to a whole pandas Series of numbers at once
+def append_gateway_bulk(numbers, country, gateway, registry=None):
+    registry = registry or gateway_registry
+    domain = registry.domain(country, gateway)
+    if domain is None:
+        return numbers.iloc[:0]
+
+    numbers = numbers.astype(str).str.strip()
+    prefix = registry.prefix(country)
+    if prefix:
+        numbers = numbers.str.removeprefix(prefix)
+    numbers = numbers.str.replace(r'\D', '', regex=True)
+    return numbers[numbers != ''] + '@' + domain
+
+# Log-bucketed latency histogram: constant memory, percentiles accurate to about 5%
+class LatencyHistogram:
+    GROWTH = 1.05
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        bucket = int(math.log(max(seconds, 1e-6) * 1e6, self.GROWTH))
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, percent):
+        # Upper bound of the bucket holding the requested rank, in seconds
+        rank = percent / 100 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return self.GROWTH ** (bucket + 1) / 1e6
+        return 0.0
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'avg_ms': self.total / self.count * 1000 if self.count else 0.0,
+            'p50_ms': self.percentile(50) * 1000,
+            'p95_ms': self.percentile(95) * 1000,
+            'p99_ms': self.percentile(99) * 1000,
+        }
+
+# Reply code (or exception name) an SMTP failure is counted under
+def smtp_error_code(error):
+    if isinstance(error, smtplib.SMTPResponseException):
+        return str(error.smtp_code)
+    if isinstance(error, smtplib.SMTPRecipientsRefused) and error.recipients:
+        return str(min(code for code, _ in error.recipients.values()))
+    return type(error).__name__
+
+# Hot-path timings for one run: per-phase and per-server latency histograms, throughput and error codes
+class SendMetrics:
+    def __init__(self, clock=time.monotonic):
+        # clock is time.monotonic, or a VirtualClock in dry runs; phase timings are always real time
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.started = clock()
+        self.messages = 0
+        self.phases = {}
+        self.servers = {}
+        self.server_errors = {}
+        self.errors = {}
+
+    @staticmethod
+    def server_label(smtp):
+        return f"{smtp['username']}@{smtp['host']}"
+
+    @contextlib.contextmanager
+    def timer(self, phase, smtp=None):
+        # Only successful phases are timed; failures show up in the error counts
+        started = time.perf_counter()
+        yield
+        self.record(phase, time.perf_counter() - started, smtp)
+
+    def record(self, phase, seconds, smtp=None):
+        with self.lock:
+            self.phases.setdefault(phase, LatencyHistogram()).add(seconds)
+            if phase == 'send' and smtp is not None:
+                self.servers.setdefault(self.server_label(smtp), LatencyHistogram()).add(seconds)
+
+    def record_message(self):
+        with self.lock:
+            self.messages += 1
+
+    def record_error(self, smtp, error):
+        code = smtp_error_code(error)
+        label = self.server_label(smtp)
+        with self.lock:
+            self.errors[code] = self.errors.get(code, 0) + 1
+            self.server_errors[label] = self.server_errors.get(label, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            elapsed = self.clock() - self.started
+            servers = {}
+            for label in set(self.servers) | set(self.server_errors):
+                servers[label] = dict(self.servers.get(label, LatencyHistogram()).summary(),
+                                      errors=self.server_errors.get(label, 0))
+            full = self.phases.get('tls_full', LatencyHistogram()).summary()
+            resumed = self.phases.get('tls_resumed', LatencyHistogram()).summary()
+            return {
+                'elapsed': elapsed,
+                'messages': self.messages,
+                'messages_per_sec': self.messages / elapsed if elapsed > 0 else 0.0,
+                'phases': {phase: histogram.summary() for phase, histogram in self.phases.items()},
+                'servers': servers,
+                'errors': dict(self.errors),
+                # Handshake time a resumed session saves, once both kinds have been seen
+                'tls': {
+                    'full': full['count'],
+                    'resumed': resumed['count'],
+                    'saved_ms': full['p50_ms'] - resumed['p50_ms'] if full['count'] and resumed['count'] else 0.0,
+                },
+            }
+
+    def write(self, path):
+        # Written to a temporary file first so readers never see a half-written snapshot
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(temporary_path, path)
+
+TLS_VERSIONS = {
+    '1.0': ssl.TLSVersion.TLSv1,
+    '1.1': ssl.TLSVersion.TLSv1_1,
+    '1.2': ssl.TLSVersion.TLSv1_2,
+    '1.3': ssl.TLSVersion.TLSv1_3,
+}
+
+# "ssl" is implicit TLS from the first byte (port 465), "starttls" upgrades a plain connection
+def smtp_security(smtp):
+    return smtp.get('security') or ('ssl' if int(smtp['port']) == 465 else 'starttls')
+
+# Handed to smtplib in place of the SSLContext, so the handshake offers the last session for this host
+class SessionOffer:
+    def __init__(self, context, session):
+        self.context = context
+        self.session = session
+
+    def wrap_socket(self, sock, **kwargs):
+        # Set before the handshake: without it, TLS records split across segments (handshake flights,
+        # large message bodies) can stall on Nagle's algorithm waiting for a delayed ACK, about 40 ms
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return self.context.wrap_socket(sock, session=self.session, **kwargs)
+
+# One SSLContext per SMTP host and TLS settings, created once, plus the last TLS session seen for it,
+# so reconnects resume the session instead of doing a full handshake. Optional TLS settings per
+# entry in smtp_details: "security" ("starttls" or "ssl"), "min_tls"/"max_tls" ("1.2", "1.3"),
+# "ciphers" (OpenSSL cipher list, TLS 1.2 and below) and "verify_tls".
+class TLSSessionCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.contexts = {}
+        self.sessions = {}
+
+    @staticmethod
+    def key(smtp):
+        return (smtp['host'], int(smtp['port']), smtp_security(smtp), smtp.get('min_tls'), smtp.get('max_tls'),
+                smtp.get('ciphers'), bool(smtp.get('verify_tls')))
+
+    @staticmethod
+    def create_context(smtp):
+        # ValueError for an unknown TLS version, ssl.SSLError for a cipher list OpenSSL can't use
+        if smtp.get('verify_tls'):
+            context = ssl.create_default_context()
+        else:
+            # Like smtplib's own default: encrypted, but the certificate is not checked
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        for setting, attribute in (('min_tls', 'minimum_version'), ('max_tls', 'maximum_version')):
+            if smtp.get(setting):
+                if smtp[setting] not in TLS_VERSIONS:
+                    raise ValueError(f"Unknown TLS version {smtp[setting]!r}, use one of {', '.join(TLS_VERSIONS)}")
+                setattr(context, attribute, TLS_VERSIONS[smtp[setting]])
+        if smtp.get('ciphers'):
+            context.set_ciphers(smtp['ciphers'])
+        return context
+
+    def offer(self, smtp):
+        key = self.key(smtp)
+        with self.lock:
+            context = self.contexts.get(key)
+            if context is None:
+                context = self.contexts[key] = self.create_context(smtp)
+            return SessionOffer(context, self.sessions.get(key))
+
+    def remember(self, smtp, server):
+        # Called once the session has exchanged data: TLS 1.3 tickets arrive after the handshake
+        session = getattr(server.sock, 'session', None)
+        if session is not None:
+            with self.lock:
+                self.sessions[self.key(smtp)] = session
+
+    def open(self, smtp, timeout=60, metrics=None):
+        # Connected and encrypted session, not yet logged in. Handshakes are timed as tls_full or
+        # tls_resumed; for implicit TLS that includes the TCP connect, which can't be told apart.
+        metrics = metrics if metrics is not None else SendMetrics()
+        offer = self.offer(smtp)
+        started = time.perf_counter()
+        if smtp_security(smtp) == 'ssl':
+            server = smtplib.SMTP_SSL(smtp['host'], smtp['port'], timeout=timeout, context=offer)
+        else:
+            with metrics.timer('connect', smtp):
+                server = smtplib.SMTP(smtp['host'], smtp['port'], timeout=timeout)
+        if smtp_security(smtp) != 'ssl':
+            started = time.perf_counter()
+            try:
+                server.starttls(context=offer)
+            except Exception:
+                server.close()
+                raise
+        resumed = server.sock.session_reused
+        metrics.record('tls_resumed' if resumed else 'tls_full', time.perf_counter() - started, smtp)
+        return server
+
+tls_sessions = TLSSessionCache()
+
+# Connects and logs in to one SMTP server, optionally sending a test email to its own From address.
+# Never raises: the result says whether it worked and how long the handshake steps took.
+def verify_smtp(smtp, timeout=15, send_test=False, tls=None):
+    tls = tls or tls_sessions
+    metrics = SendMetrics()
+    started = time.perf_counter()
+    try:
+        server = tls.open(smtp, timeout, metrics)
+        try:
+            with metrics.timer('login', smtp):
+                server.login(smtp['username'], smtp['password'])
+            if send_test:
+                from email.mime.text import MIMEText
+                test_msg = MIMEText('This is a test email.', 'html')
+                test_msg['From'] = smtp['from_email']
+                test_msg['To'] = smtp['from_email']
+                test_msg['Subject'] = 'Test Email'
+                with metrics.timer('send', smtp):
+                    server.sendmail(smtp['from_email'], smtp['from_email'], test_msg.as_string())
+            tls.remember(smtp, server)
+        finally:
+            try:
+                server.quit()
+            except (smtplib.SMTPException, OSError):
+                server.close()
+    except Exception as e:
+        return {'ok': False, 'error': str(e) or type(e).__name__, 'code': smtp_error_code(e),
+                'total_ms': (time.perf_counter() - started) * 1000}
+    phases = metrics.snapshot()['phases']
+    resumed = 'tls_resumed' in phases
+    return {
+        'ok': True,
+        'error': None,
+        'code': None,
+        'total_ms': (time.perf_counter() - started) * 1000,
+        'connect_ms': phases.get('connect', {}).get('avg_ms'),  # None for implicit TLS, timed with the handshake
+        'tls_ms': phases['tls_resumed' if resumed else 'tls_full']['avg_ms'],
+        'tls_resumed': resumed,
+        'login_ms': phases['login']['avg_ms'],
+    }
+
+# Checks every server at once; on_result(smtp, result) is called from worker threads as each one answers
+def verify_smtp_all(smtp_details, timeout=15, workers=8, on_result=None, tls=None):
+    results = [None] * len(smtp_details)
+    if not smtp_details:
+        return results
+    with ThreadPoolExecutor(max_workers=min(workers, len(smtp_details)), thread_name_prefix='verify') as executor:
+        futures = {executor.submit(verify_smtp, smtp, timeout, False, tls): index
+                   for index, smtp in enumerate(smtp_details)}
+        for future in as_completed(futures):
+            index = futures[future]
+            results[index] = future.result()
+            if on_result:
+                on_result(smtp_details[index], results[index])
+    return results
+
+# Pool of authenticated SMTP sessions, one idle list per entry in smtp_details
+class SMTPConnectionPool:
+    def __init__(self, timeout=60, noop_after=15, metrics=None, tls=None):
+        self.timeout = timeout
+        self.metrics = metrics if metrics is not None else SendMetrics()
+        self.tls = tls or tls_sessions
+        self.noop_after = noop_after  # Seconds idle before a session is checked with NOOP
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def key(self, smtp):
+        return (smtp['host'], int(smtp['port']), smtp['username'])
+
+    # metrics, where taken, defaults to the pool's own; see view()
+    def connect(self, smtp, metrics=None):
+        metrics = metrics or self.metrics
+        server = self.tls.open(smtp, self.timeout, metrics)
+        try:
+            with metrics.timer('login', smtp):
+                server.login(smtp['username'], smtp['password'])
+        except Exception:
+            self.discard(server)
+            raise
+        self.tls.remember(smtp, server)
+        return server
+
+    def acquire(self, smtp, metrics=None):
+        # Returns (server, reused); idle sessions are checked before being handed out
+        metrics = metrics or self.metrics
+        key = self.key(smtp)
+        while True:
+            with self.lock:
+                sessions = self.idle.get(key)
+                if not sessions:
+                    break
+                server, last_used = sessions.pop()
+            if time.monotonic() - last_used < self.noop_after:
+                return server, True
+            try:
+                with metrics.timer('noop', smtp):
+                    code = server.noop()[0]
+                if code == 250:
+                    return server, True
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.discard(server)
+        return self.connect(smtp, metrics), False
+
+    def release(self, smtp, server):
+        # Sessions dropped by the server (e.g. after a 421) are not put back
+        if server.sock is None:
+            return
+        with self.lock:
+            if not self.closed:
+                self.idle.setdefault(self.key(smtp), []).append((server, time.monotonic()))
+                return
+        self.discard(server)
+
+    def discard(self, server):
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def is_dropped(self, error):
+        # 421 replies and socket-level failures mean the session can't be reused
+        if isinstance(error, smtplib.SMTPResponseException):
+            return error.smtp_code == 421
+        if isinstance(error, smtplib.SMTPServerDisconnected):
+            return True
+        return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+    def sendmail(self, smtp, from_email, to_email, message, metrics=None):
+        metrics = metrics or self.metrics
+        server, reused = self.acquire(smtp, metrics)
+        try:
+            with metrics.timer('send', smtp):
+                server.sendmail(from_email, to_email, message)
+        except Exception as e:
+            if not self.is_dropped(e):
+                self.release(smtp, server)
+                raise
+            self.discard(server)
+            if not reused:
+                raise
+            # A reused session went stale (421 or server-side timeout), retry once on a fresh one
+            server = self.connect(smtp, metrics)
+            try:
+                with metrics.timer('send', smtp):
+                    server.sendmail(from_email, to_email, message)
+            finally:
+                self.release(smtp, server)
+            return
+        self.release(smtp, server)
+
+    def probe(self, smtp, metrics=None):
+        # Fresh connect and login to check that a server is back; returns the error, None if it worked
+        try:
+            server = self.connect(smtp, metrics)
+        except Exception as e:
+            return e
+        self.release(smtp, server)
+        return None
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            sessions = [server for idle in self.idle.values() for server, _ in idle]
+            self.idle.clear()
+        for server in sessions:
+            self.discard(server)
+
+    def view(self, metrics):
+        return SMTPPoolView(self, metrics)
+
+# One campaign's handle on a pool shared through a CampaignQueue: the same sessions, timed into the
+# campaign's own metrics. The queue closes the pool itself once no campaign is running.
+class SMTPPoolView:
+    def __init__(self, pool, metrics):
+        self.pool = pool
+        self.metrics = metrics
+
+    def sendmail(self, smtp, from_email, to_email, message):
+        self.pool.sendmail(smtp, from_email, to_email, message, self.metrics)
+
+    def probe(self, smtp):
+        return self.pool.probe(smtp, self.metrics)
+
+    def close(self):
+        pass
+
+# Leads streamed from a text, CSV or Excel file instead of being held in memory
+class LeadSource:
+    # Column names picked as the lead column in CSV/XLSX files, otherwise the first column is used
+    LEAD_COLUMNS = ('email', 'phone', 'number', 'mobile', 'lead', 'leads', 'recipient')
+    CHUNK_SIZE = 50000
+
+    def __init__(self, path):
+        self.path = path
+        self.count = None
+        self.header = None  # First row of a CSV/XLSX file, read when merge fields are needed
+        extension = os.path.splitext(path)[1].lower()
+        self.kind = {'.csv': 'csv', '.xlsx': 'xlsx', '.xlsm': 'xlsx'}.get(extension, 'text')
+
+    def pick_column(self, header):
+        # Returns (column index, whether the first row is a header)
+        names = [str(cell).strip().lower() if cell is not None else '' for cell in header]
+        for column, name in enumerate(names):
+            if name in self.LEAD_COLUMNS:
+                return column, True
+        first = names[0] if names else ''
+        looks_like_lead = '@' in first or first.lstrip('+').replace('-', '').replace(' ', '').isdigit()
+        return 0, not looks_like_lead
+
+    @property
+    def field_names(self):
+        # Merge field names of the columns next to the lead column; text files and headerless sheets have none
+        if self.kind == 'text':
+            return []
+        if self.header is None:
+            self.header = self.read_header()
+        column, has_header = self.pick_column(self.header)
+        if not has_header:
+            return []
+        return [merge_field_name(name) for index, name in enumerate(self.header) if index != column]
+
+    def read_header(self):
+        if self.kind == 'csv':
+            import pandas as pd
+            return list(pd.read_csv(self.path, nrows=0, dtype=str).columns)
+        import openpyxl
+        workbook = openpyxl.load_workbook(self.path, read_only=True)
+        try:
+            return list(next(workbook.active.iter_rows(values_only=True), ()))
+        finally:
+            workbook.close()
+
+    def read_text(self):
+        with open(self.path, 'r', encoding='utf-8', errors='replace') as file:
+            for line in file:
+                yield line.strip()
+
+    def read_csv(self):
+        import pandas as pd
+        header = pd.read_csv(self.path, nrows=0, dtype=str).columns
+        column, has_header = self.pick_column(header)
+        chunks = pd.read_csv(self.path, dtype=str, header=0 if has_header else None,
+                             usecols=[column], chunksize=self.CHUNK_SIZE)
+        for chunk in chunks:
+            yield from chunk.iloc[:, 0].dropna().str.strip()
+
+    def read_csv_records(self, column, names):
+        import pandas as pd
+        chunks = pd.read_csv(self.path, dtype=str, keep_default_na=False, chunksize=self.CHUNK_SIZE)
+        for chunk in chunks:
+            others = chunk.iloc[:, [index for index in range(chunk.shape[1]) if index != column]]
+            for lead, values in zip(chunk.iloc[:, column].str.strip(), others.itertuples(index=False, name=None)):
+                yield lead, dict(zip(names, (value.strip() for value in values)))
+
+    def read_xlsx(self):
+        # pandas can't chunk Excel files, so rows are streamed with its openpyxl engine
+        import openpyxl
+        workbook = openpyxl.load_workbook(self.path, read_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            first = next(rows, None)
+            if first is None:
+                return
+            column, has_header = self.pick_column(first)
+            if not has_header:
+                rows = itertools.chain([first], rows)
+            for row in rows:
+                if column < len(row) and row[column] is not None:
+                    yield str(row[column]).strip()
+        finally:
+            workbook.close()
+
+    def read_xlsx_records(self, column, names):
+        import openpyxl
+        workbook = openpyxl.load_workbook(self.path, read_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            next(rows, None)
+            for row in rows:
+                if column < len(row) and row[column] is not None:
+                    values = ('' if value is None else str(value).strip() for index, value in enumerate(row) if index != column)
+                    yield str(row[column]).strip(), dict(zip(names, values))
+        finally:
+            workbook.close()
+
+    def __iter__(self):
+        readers = {'text': self.read_text, 'csv': self.read_csv, 'xlsx': self.read_xlsx}
+        for lead in readers[self.kind]():
+            if lead:
+                yield lead
+
+    def records(self, with_fields=True):
+        # (lead, fields) pairs, fields mapping merge field names to the row's values (None without extra columns)
+        names = self.field_names if with_fields else []
+        if not names:
+            yield from ((lead, None) for lead in self)
+            return
+        column, _ = self.pick_column(self.header)
+        reader = self.read_csv_records if self.kind == 'csv' else self.read_xlsx_records
+        for lead, fields in reader(column, names):
+            if lead:
+                yield lead, fields
+
+    def __len__(self):
+        # Counted with one streaming pass the first time it is asked for
+        if self.count is None:
+            if self.kind == 'text':
+                with open(self.path, 'rb') as file:
+                    self.count = sum(1 for line in file if line.strip())
+            else:
+                self.count = sum(1 for _ in self)
+        return self.count
+
+    def discard(self):
+        # Deletes the file if this module wrote it (see temporary_lead_file); uploaded files are left alone
+        if self.path in temporary_lead_files:
+            temporary_lead_files.discard(self.path)
+            with contextlib.suppress(OSError):
+                os.remove(self.path)
+
+# Lead files written by append_gateway_to_file and check_leads. Whoever holds the LeadSource
+# discards it once a newer one replaces it or its run is over; remove_temporary_leads() clears
+# whatever is left when the app exits.
+temporary_lead_files = set()
+
+def temporary_lead_file(prefix, suffix):
+    fd, path = tempfile.mkstemp(prefix=prefix, suffix=suffix)
+    temporary_lead_files.add(path)
+    return fd, path
+
+def remove_temporary_leads():
+    for path in list(temporary_lead_files):
+        LeadSource(path).discard()
+
+# For leads that may also be a plain list, which has nothing to delete
+def discard_leads(leads):
+    if isinstance(leads, LeadSource):
+        leads.discard()
+
+# Leads as (lead, fields) pairs whatever their source; typed leads never have fields
+def lead_records(leads, with_fields=True):
+    if isinstance(leads, LeadSource):
+        return leads.records(with_fields)
+    return ((lead, None) for lead in leads)
+
+# Set of seen leads that moves into a temporary SQLite table once it outgrows memory
+class SpillingSet:
+    def __init__(self, max_in_memory=2000000):
+        self.max_in_memory = max_in_memory
+        self.memory = set()
+        self.db = None
+
+    def add(self, item):
+        # Returns True if the item was not seen before
+        if self.db is not None:
+            return self.db.execute('INSERT OR IGNORE INTO seen VALUES (?)', (item,)).rowcount == 1
+        if item in self.memory:
+            return False
+        self.memory.add(item)
+        if len(self.memory) > self.max_in_memory:
+            self.spill()
+        return True
+
+    def spill(self):
+        # An empty filename gives a private on-disk database that is deleted on close
+        self.db = sqlite3.connect('')
+        self.db.execute('PRAGMA journal_mode=OFF')
+        self.db.execute('PRAGMA synchronous=OFF')
+        self.db.execute('CREATE TABLE seen (item TEXT PRIMARY KEY) WITHOUT ROWID')
+        self.db.executemany('INSERT INTO seen VALUES (?)', ((item,) for item in self.memory))
+        self.memory = set()
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+        self.memory = set()
+
+# Pre-send pass dropping duplicate, malformed and unknown-gateway leads before they cost an SMTP round trip
+class LeadChecker:
+    EMAIL_PATTERN = re.compile(
+        r"^[A-Za-z0-9.!#$%&'*+/=?^_`{|}~-]+@"
+        r"[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?(?:\.[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?)+$"
+    )
+
+    def __init__(self, registry=None, max_in_memory=2000000, required_fields=()):
+        self.gateway_domains = (registry or gateway_registry).domains()
+        self.max_in_memory = max_in_memory
+        self.required_fields = required_fields  # Merge fields used without a default
+        self.stats = {'total': 0, 'accepted': 0, 'duplicates': 0, 'invalid': 0, 'unknown_gateway': 0,
+                      'missing_fields': 0}
+
+    def problem(self, lead):
+        # Returns the stats key a lead is rejected under, or None if it can be sent
+        if len(lead) > 254 or not self.EMAIL_PATTERN.match(lead):
+            return 'invalid'
+        local, domain = lead.rsplit('@', 1)
+        # All-digit mailboxes are SMS gateway addresses, so their domain must be a known carrier
+        if local.isdigit() and domain.lower() not in self.gateway_domains:
+            return 'unknown_gateway'
+        return None
+
+    def iter_valid(self, leads):
+        for lead, _ in self.iter_valid_records((lead, None) for lead in leads):
+            yield lead
+
+    def iter_valid_records(self, records):
+        # Same checks for (lead, fields) pairs, also dropping rows with an empty required merge field
+        seen = SpillingSet(self.max_in_memory)
+        try:
+            for lead, fields in records:
+                lead = lead.strip()
+                if not lead:
+                    continue
+                self.stats['total'] += 1
+                problem = self.problem(lead)
+                if problem is None and self.required_fields and not all((fields or {}).get(name) for name in self.required_fields):
+                    problem = 'missing_fields'
+                if problem is None and not seen.add(lead.lower()):
+                    problem = 'duplicates'
+                if problem:
+                    self.stats[problem] += 1
+                    continue
+                self.stats['accepted'] += 1
+                yield lead, fields
+        finally:
+            seen.close()
+
+# Opt-outs and permanent failures, kept in an indexed SQLite table and checked for every lead
+class SuppressionStore:
+    IMPORT_BATCH = 50000
+
+    def __init__(self, path='suppression.db'):
+        # Each thread opens its own store; WAL lets the sender read while the GUI imports
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS suppressed ('
+            'address TEXT PRIMARY KEY, reason TEXT, added_at REAL) WITHOUT ROWID'
+        )
+        self.db.commit()
+
+    def contains(self, address):
+        return self.db.execute(
+            'SELECT 1 FROM suppressed WHERE address = ?', (address.strip().lower(),)
+        ).fetchone() is not None
+
+    def add(self, address, reason):
+        self.db.execute(
+            'INSERT OR IGNORE INTO suppressed VALUES (?, ?, ?)', (address.strip().lower(), reason, time.time())
+        )
+        self.db.commit()
+
+    def import_leads(self, leads, reason='opt-out'):
+        # Bulk import in batches, returns how many addresses were new
+        before = self.count()
+        leads = iter(leads)
+        while True:
+            batch = [(lead.lower(), reason, time.time()) for lead in itertools.islice(leads, self.IMPORT_BATCH)]
+            if not batch:
+                break
+            self.db.executemany('INSERT OR IGNORE INTO suppressed VALUES (?, ?, ?)', batch)
+            self.db.commit()
+        return self.count() - before
+
+    def count(self):
+        return self.db.execute('SELECT COUNT(*) FROM suppressed').fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+# Append-only record of every recipient's outcome, fsynced in batches so a crash loses at most one batch
+class CampaignJournal:
+    # Recipients with these outcomes are skipped when the campaign is resumed
+    DONE_STATUSES = ('Success', 'Skipped')
+
+    def __init__(self, path, subject='', sync_every=200, sync_interval=1.0):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.done = set()
+        self.complete_size = 0
+        if os.path.exists(path):
+            self.load()
+            if self.torn:
+                # Cut the partial line off rather than finish it, or it would read as a recipient next time
+                os.truncate(path, self.complete_size)
+        self.file = open(path, 'a', encoding='utf-8')
+        if self.complete_size == 0:  # New, or even the header was cut off
+            self.file.write(json.dumps({'campaign': os.path.splitext(os.path.basename(path))[0],
+                                        'subject': subject, 'created': time.time()}) + '\n')
+        self.sync()
+
+    @staticmethod
+    def new_path(directory='campaigns'):
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}.journal")
+
+    @staticmethod
+    def read_header(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.loads(f.readline())
+
+    def load(self):
+        self.torn = False
+        self.complete_size = 0  # Bytes up to the end of the last complete line
+        with open(self.path, 'rb') as f:
+            for number, raw in enumerate(f):
+                # A last line without a newline was cut off by a crash and is ignored
+                if not raw.endswith(b'\n'):
+                    self.torn = True
+                    break
+                self.complete_size += len(raw)
+                if number == 0:
+                    continue  # Header
+                line = raw.decode('utf-8', errors='replace').rstrip('\r\n')
+                status, _, recipient = line.partition('\t')
+                if status in self.DONE_STATUSES:
+                    self.done.add(recipient)
+
+    def record(self, status, recipient):
+        self.file.write(f"{status}\t{recipient}\n")
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every or time.monotonic() - self.synced_at >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+# Per-recipient results kept in SQLite (WAL), indexed by campaign, recipient, status and SMTP account
+class LogStore:
+    COLUMNS = ('campaign', 'recipient', 'status', 'smtp', 'message', 'logged_at')
+
+    def __init__(self, path='email_logs.db'):
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS logs (id INTEGER PRIMARY KEY, campaign TEXT, recipient TEXT, '
+            'status TEXT, smtp TEXT, message TEXT, logged_at REAL)'
+        )
+        for column in ('campaign', 'recipient', 'status', 'smtp'):
+            self.db.execute(f'CREATE INDEX IF NOT EXISTS logs_{column} ON logs ({column})')
+        self.db.commit()
+
+    def insert_many(self, rows):
+        self.db.executemany('INSERT INTO logs (campaign, recipient, status, smtp, message, logged_at) '
+                            'VALUES (?, ?, ?, ?, ?, ?)', rows)
+        self.db.commit()
+
+    def where(self, campaign=None, recipient=None, status=None, smtp=None):
+        # Exact match on campaign and status, prefix match on recipient and SMTP (index-friendly ranges)
+        clauses, params = [], []
+        for column, value in (('campaign', campaign), ('status', status)):
+            if value:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        for column, value in (('recipient', recipient), ('smtp', smtp)):
+            if value:
+                clauses.append(f'{column} >= ? AND {column} < ?')
+                params.extend((value, value + '\uffff'))
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def count(self, **filters):
+        where, params = self.where(**filters)
+        return self.db.execute('SELECT COUNT(*) FROM logs' + where, params).fetchone()[0]
+
+    def page(self, limit, offset, **filters):
+        where, params = self.where(**filters)
+        return self.db.execute(
+            'SELECT recipient, status, smtp, message FROM logs' + where + ' ORDER BY id LIMIT ? OFFSET ?',
+            params + [limit, offset]
+        ).fetchall()
+
+    def iter_rows(self, batch_size=5000, **filters):
+        # Streams matching rows for export without loading them all
+        where, params = self.where(**filters)
+        cursor = self.db.execute('SELECT ' + ', '.join(self.COLUMNS) + ' FROM logs' + where + ' ORDER BY id', params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+
+    def campaigns(self):
+        return [row[0] for row in self.db.execute('SELECT DISTINCT campaign FROM logs ORDER BY campaign')]
+
+    def close(self):
+        self.db.close()
+
+# Background thread that batches log entries into the LogStore so the send loop never waits on disk
+class LogWriter(threading.Thread):
+    def __init__(self, path='email_logs.db', batch_size=1000, interval=0.5):
+        super().__init__(daemon=True)
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = queue.Queue()
+
+    def write(self, campaign, entries):
+        now = time.time()
+        self.queue.put([(campaign, entry['recipient'], entry['status'], entry['smtp'], entry['message'], now)
+                        for entry in entries])
+
+    def run(self):
+        store = LogStore(self.path)
+        rows = []
+        stopping = False
+        while not stopping:
+            try:
+                item = self.queue.get(timeout=self.interval)
+                if item is None:
+                    stopping = True
+                else:
+                    rows.extend(item)
+                    if len(rows) < self.batch_size:
+                        continue
+            except queue.Empty:
+                pass
+            if rows:
+                store.insert_many(rows)
+                rows = []
+        store.close()
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+
+# Recipients rejected with a 5xx reply won't accept a later attempt either
+def is_permanent_recipient_failure(error):
+    return isinstance(error, smtplib.SMTPRecipientsRefused) and all(
+        500 <= code < 600 for code, _ in error.recipients.values()
+    )
+
+# Sorts a send failure into 'server' (the server or session is unusable: connection errors, 421, login or
+# sender rejected), 'transient' (a 4xx for this message, worth retrying later) or 'permanent' (don't retry)
+def classify_failure(error):
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return 'permanent' if is_permanent_recipient_failure(error) else 'transient'
+    if isinstance(error, (smtplib.SMTPAuthenticationError, smtplib.SMTPSenderRefused, smtplib.SMTPHeloError,
+                          smtplib.SMTPConnectError)):
+        return 'server'
+    if isinstance(error, smtplib.SMTPResponseException):
+        if error.smtp_code == 421:
+            return 'server'
+        return 'transient' if 400 <= error.smtp_code < 500 else 'permanent'
+    if isinstance(error, OSError):
+        return 'server'
+    return 'permanent'
+
+# Recipients waiting to be retried, ordered by due time; delays grow exponentially with random jitter
+class RetryQueue:
+    def __init__(self, base_delay=60, max_delay=900, max_attempts=4, clock=time.monotonic):
+        self.clock = clock
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts  # Including the first try
+        self.heap = []
+        self.sequence = itertools.count()
+
+    def push(self, lead, attempt):
+        # attempt is the number of tries so far; returns the delay, or None once the attempts are used up
+        if attempt >= self.max_attempts:
+            return None
+        # "Equal jitter": at least half the backoff, so retries never bunch up right after a failure
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        delay = random.uniform(delay / 2, delay)
+        heapq.heappush(self.heap, (self.clock() + delay, next(self.sequence), lead, attempt))
+        return delay
+
+    def pop_due(self):
+        # (lead, attempt) for the earliest retry that is due, None if nothing is due yet
+        if self.heap and self.heap[0][0] <= self.clock():
+            _, _, lead, attempt = heapq.heappop(self.heap)
+            return lead, attempt
+        return None
+
+    def next_due(self):
+        return self.heap[0][0] if self.heap else None
+
+    def __len__(self):
+        return len(self.heap)
+
+# Takes a server out of the schedule after repeated server failures and probes it before putting it back
+class CircuitBreaker:
+    CLOSED = 'closed'  # In the schedule
+    OPEN = 'open'  # Cooling down until retry_at
+    PROBING = 'probing'  # Probe connection in progress
+    FAILED = 'failed'  # Gave up on this server for the rest of the run
+
+    def __init__(self, failure_threshold=5, cooldown=30, max_cooldown=600, max_probes=6, clock=time.monotonic):
+        self.clock = clock
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.max_probes = max_probes
+        self.state = self.CLOSED
+        self.failures = 0
+        self.failed_probes = 0
+        self.cooldown = cooldown
+        self.retry_at = 0
+
+    def record_success(self):
+        self.failures = 0
+
+    def record_failure(self):
+        # Returns True when this failure opens the circuit
+        self.failures += 1
+        if self.state == self.CLOSED and self.failures >= self.failure_threshold:
+            self.open()
+            return True
+        return False
+
+    def open(self):
+        self.state = self.OPEN
+        self.retry_at = self.clock() + self.cooldown
+
+    def probe_due(self):
+        return self.state == self.OPEN and self.clock() >= self.retry_at
+
+    def probe_started(self):
+        self.state = self.PROBING
+
+    def probe_finished(self, ok):
+        if ok:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.failed_probes = 0
+            self.cooldown = self.base_cooldown
+            return
+        self.failed_probes += 1
+        if self.failed_probes >= self.max_probes:
+            self.state = self.FAILED
+            return
+        # Each failed probe doubles the wait before the next one
+        self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+        self.open()
+
+# Picks the SMTP server for each send: the rotate_count rotation over smtp_details, skipping open circuits
+class SMTPScheduler:
+    def __init__(self, smtp_details, rotate_count, clock=time.monotonic, **breaker_options):
+        self.breakers = [CircuitBreaker(clock=clock, **breaker_options) for _ in smtp_details]
+        self.rotate_count = max(1, rotate_count)
+        self.turn = 0
+
+    def pick(self, delay=None):
+        # Index of the next healthy server, None while every circuit is open. delay(smtp_index) is how
+        # long that server's own rate limit would hold a send: servers that would wait are passed over
+        # like open circuits, and only when every healthy one would is the one ready soonest picked.
+        count = len(self.breakers)
+        start = (self.turn // self.rotate_count) % count
+        soonest = None
+        for offset in range(count):
+            smtp_index = (start + offset) % count
+            if self.breakers[smtp_index].state == CircuitBreaker.CLOSED:
+                wait = delay(smtp_index) if delay else 0
+                if wait == 0:
+                    self.turn += 1
+                    return smtp_index
+                if soonest is None or wait < soonest[0]:
+                    soonest = (wait, smtp_index)
+        if soonest:
+            self.turn += 1
+            return soonest[1]
+        return None
+
+    def due_probes(self):
+        return [smtp_index for smtp_index, breaker in enumerate(self.breakers) if breaker.probe_due()]
+
+    def exhausted(self):
+        # Every server has been given up on
+        return all(breaker.state == CircuitBreaker.FAILED for breaker in self.breakers)
+
+# Token bucket refilled continuously, so sends are spread evenly instead of bursting
+class TokenBucket:
+    def __init__(self, rate, per, capacity=1, clock=time.monotonic):
+        self.clock = clock
+        self.rate = rate / per  # Tokens per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = clock()
+
+    def delay(self):
+        # Seconds until a token is available, 0 if one is available now
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        # Waiting exactly the returned delay can leave a rounding error short of a whole token
+        return 0 if self.tokens >= 1 - 1e-9 else (1 - self.tokens) / self.rate
+
+# Global speed limit plus optional per-SMTP limits ('max_per_hour' in smtp_details)
+class RateLimiter:
+    def __init__(self, speed_value, speed_unit, smtp_details, clock=time.monotonic):
+        self.lock = threading.Lock()
+        self.global_bucket = TokenBucket(speed_value, 3600 if speed_unit == 'hour' else 60, clock=clock)
+        self.smtp_buckets = [
+            TokenBucket(smtp['max_per_hour'], 3600, clock=clock) if smtp.get('max_per_hour') else None
+            for smtp in smtp_details
+        ]
+
+    def reserve(self, smtp_index):
+        # Takes a token from every bucket that applies, or returns how long to wait first
+        buckets = [self.global_bucket]
+        if self.smtp_buckets[smtp_index]:
+            buckets.append(self.smtp_buckets[smtp_index])
+        with self.lock:
+            wait = max(bucket.delay() for bucket in buckets)
+            if wait == 0:
+                for bucket in buckets:
+                    bucket.tokens -= 1
+            return wait
+
+    def smtp_delay(self, smtp_index):
+        # Wait for this server's own limit alone; the global speed limit holds every server alike
+        bucket = self.smtp_buckets[smtp_index]
+        if bucket is None:
+            return 0
+        with self.lock:
+            return bucket.delay()
+
+# Rate limits for campaigns sending through the same SMTP accounts at the same time. Each campaign keeps
+# its own speed limit; the per-SMTP hourly limits are shared. When campaigns compete for the same
+# account, the token goes to the one with the fewest sends for its weight, so capacity a throttled or
+# paused campaign leaves unused goes to the others instead of waiting for it.
+class SharedRateLimiter:
+    YIELD_DELAY = 0.01  # How long a campaign waits after giving its turn to one further behind
+    STALE_AFTER = 0.25  # Campaigns ask at least every CampaignSender.POLL_INTERVAL while they wait
+
+    def __init__(self, smtp_details, clock=time.monotonic):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.smtp_buckets = [
+            TokenBucket(smtp['max_per_hour'], 3600, clock=clock) if smtp.get('max_per_hour') else None
+            for smtp in smtp_details
+        ]
+        self.shares = []
+
+    def join(self, speed_value, speed_unit, weight=1):
+        with self.lock:
+            # A newcomer starts level with the campaign that has had the least, not at zero,
+            # so it can't claim every token until it has caught up with campaigns that ran for hours
+            served = min((share.served for share in self.shares), default=0.0)
+            share = RateShare(self, TokenBucket(speed_value, 3600 if speed_unit == 'hour' else 60, clock=self.clock),
+                              weight, served)
+            self.shares.append(share)
+            return share
+
+    def leave(self, share):
+        with self.lock:
+            self.shares.remove(share)
+
+    def delay(self, share, smtp_index):
+        buckets = [share.bucket]
+        if self.smtp_buckets[smtp_index]:
+            buckets.append(self.smtp_buckets[smtp_index])
+        return max(bucket.delay() for bucket in buckets)
+
+    def reserve(self, share, smtp_index):
+        with self.lock:
+            now = self.clock()
+            share.wants = smtp_index
+            share.asked_at = now
+            wait = self.delay(share, smtp_index)
+            if wait:
+                return wait
+            if self.smtp_buckets[smtp_index]:
+                for other in self.shares:
+                    if (other is not share and other.wants == smtp_index and now - other.asked_at < self.STALE_AFTER
+                            and other.served < share.served and self.delay(other, smtp_index) == 0):
+                        return self.YIELD_DELAY
+                self.smtp_buckets[smtp_index].tokens -= 1
+            share.bucket.tokens -= 1
+            share.served += 1 / share.weight
+            share.wants = None
+            return 0
+
+    def smtp_delay(self, smtp_index):
+        bucket = self.smtp_buckets[smtp_index]
+        if bucket is None:
+            return 0
+        with self.lock:
+            return bucket.delay()
+
+# One campaign's view of a SharedRateLimiter; used wherever a RateLimiter is
+class RateShare:
+    def __init__(self, limiter, bucket, weight, served):
+        self.limiter = limiter
+        self.bucket = bucket
+        self.weight = weight
+        self.served = served
+        self.wants = None
+        self.asked_at = 0
+
+    def reserve(self, smtp_index):
+        return self.limiter.reserve(self, smtp_index)
+
+    def smtp_delay(self, smtp_index):
+        return self.limiter.smtp_delay(smtp_index)
+
+# Achieved send rate over a sliding window
+class RateMeter:
+    def __init__(self, window=60, clock=time.monotonic):
+        self.clock = clock
+        self.window = window
+        self.started = clock()
+        self.sent = deque()
+
+    def record(self):
+        now = self.clock()
+        self.sent.append(now)
+        while self.sent[0] < now - self.window:
+            self.sent.popleft()
+
+    def per_minute(self):
+        elapsed = min(self.window, self.clock() - self.started)
+        return len(self.sent) * 60 / elapsed if elapsed > 0 else 0.0
+
+# Limits checked before a campaign starts. Most providers reject messages over 25 MB, and base64
+# makes attachments about a third larger on the wire, so the total is counted in encoded bytes.
+MAX_ATTACHMENT_BYTES = 25 * 1024 * 1024
+MAX_PAYLOAD_BYTES = 35 * 1024 * 1024
+# Files from this size up are hashed and encoded through mmap instead of being read into memory
+MMAP_THRESHOLD = 1024 * 1024
+
+def format_size(size):
+    if size < 1024:
+        return f"{size} bytes"
+    if size < 1024 * 1024:
+        return f"{size / 1024:.1f} KB"
+    return f"{size / (1024 * 1024):.1f} MB"
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    parts = [f"{value}{unit}" for value, unit in ((days, 'd'), (hours, 'h'), (minutes, 'm'), (seconds, 's')) if value]
+    # The two largest units are precise enough for a projection
+    return ' '.join(parts[:2]) or '0s'
+
+def encoded_size(size):
+    # Length of encode_base64_lines() output for size bytes of input
+    chars = (size + 2) // 3 * 4
+    return chars + (chars + 75) // 76 * 2
+
+def encode_base64_lines(data, chunk_size=57 * 16384):
+    # Base64 in 76-character CRLF-terminated lines; chunks are a multiple of 57 bytes so they join up
+    # into whole lines, and slicing a memoryview keeps mmapped input from being copied in one piece
+    lines = []
+    for start in range(0, len(data), chunk_size):
+        chunk = data[start:start + chunk_size] if len(data) > chunk_size else data
+        encoded = binascii.b2a_base64(chunk, newline=False)
+        lines += [encoded[offset:offset + 76] for offset in range(0, len(encoded), 76)]
+    return b'\r\n'.join(lines) + b'\r\n' if lines else b''
+
+@contextlib.contextmanager
+def file_contents(path):
+    # Bytes-like view of a file: mmapped when large, read in one go when small
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < MMAP_THRESHOLD:
+            yield f.read()
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as view:
+                yield view
+
+# A file to attach, validated and hashed when it is added. The SHA-256 of the contents keys the
+# encoded part in AttachmentCache, so a renamed or copied file is still a cache hit.
+class Attachment:
+    def __init__(self, path, size, mtime_ns, digest):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.digest = digest
+
+    @classmethod
+    def load(cls, path, max_bytes=MAX_ATTACHMENT_BYTES):
+        # OSError if the file can't be read, ValueError if it is too large to send
+        stat = os.stat(path)
+        if stat.st_size > max_bytes:
+            raise ValueError(f"{os.path.basename(path)} is {format_size(stat.st_size)}, "
+                             f"the limit per attachment is {format_size(max_bytes)}")
+        digest = hashlib.sha256()
+        with file_contents(path) as data:
+            digest.update(data)
+        return cls(path, stat.st_size, stat.st_mtime_ns, digest.hexdigest())
+
+    @property
+    def encoded_size(self):
+        return encoded_size(self.size)
+
+    def refresh(self, max_bytes=MAX_ATTACHMENT_BYTES):
+        # The file may have changed since it was added; only a changed size or mtime means hashing it again
+        stat = os.stat(self.path)
+        if (stat.st_size, stat.st_mtime_ns) == (self.size, self.mtime_ns):
+            return self
+        return Attachment.load(self.path, max_bytes)
+
+    def encode(self):
+        with file_contents(self.path) as data:
+            return encode_base64_lines(data)
+
+def check_attachments(attachments, max_bytes=MAX_ATTACHMENT_BYTES, max_payload=MAX_PAYLOAD_BYTES):
+    # Paths or Attachments in, up-to-date Attachments out; raises OSError or ValueError before anything is sent
+    checked = [attachment.refresh(max_bytes) if isinstance(attachment, Attachment) else Attachment.load(attachment, max_bytes)
+               for attachment in attachments]
+    payload = sum(attachment.encoded_size for attachment in checked)
+    if payload > max_payload:
+        raise ValueError(f"The attachments add up to {format_size(payload)} once encoded, "
+                         f"the limit per message is {format_size(max_payload)}")
+    return checked
+
+# Encoded attachment bodies on disk, named by the SHA-256 of the file contents, so sending the same
+# files again skips encoding entirely. Least recently used entries are removed past max_bytes.
+class AttachmentCache:
+    def __init__(self, directory='attachment_cache', max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest + '.b64')
+
+    def get(self, attachment):
+        path = self.path(attachment.digest)
+        try:
+            with open(path, 'rb') as f:
+                encoded = f.read()
+            # A truncated entry (e.g. disk full) is encoded again
+            if len(encoded) == attachment.encoded_size:
+                os.utime(path)
+                return encoded
+        except OSError:
+            pass
+        encoded = attachment.encode()
+        self.put(attachment.digest, encoded)
+        return encoded
+
+    def put(self, digest, encoded):
+        # Written to a temp file and renamed, so concurrent campaigns never read a partial entry
+        # The cache is only an optimisation; a full disk just means encoding again next time
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(encoded)
+            os.replace(temp_path, self.path(digest))
+        except OSError:
+            with contextlib.suppress(OSError):
+                os.remove(temp_path)
+            return
+        self.prune()
+
+    def prune(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.b64'):
+                    with contextlib.suppress(OSError):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            with contextlib.suppress(OSError):
+                os.remove(path)
+                total -= size
+
+# {{field}} or {{field|default}}; field names match lead columns case-insensitively, spaces as underscores
+MERGE_FIELD = re.compile(r'\{\{\s*([^{}|]+?)\s*(?:\|([^{}]*))?\}\}')
+
+def merge_field_name(name):
+    return re.sub(r'\s+', '_', str(name).strip().lower())
+
+# Text with merge fields, compiled once into literal pieces and slots, so rendering is a list copy and a join
+class MergeTemplate:
+    # escape is applied to values from the leads, not to defaults, which are part of the template
+    def __init__(self, text, escape=None):
+        self.placeholders = []  # Distinct (field name, default or None) pairs
+        self.pieces = []  # Literal text, with None where a value goes
+        self.slots = []  # (index in pieces, index in placeholders)
+        numbers = {}
+        position = 0
+        for match in MERGE_FIELD.finditer(text):
+            self.pieces.append(text[position:match.start()])
+            default = match.group(2)
+            placeholder = (merge_field_name(match.group(1)), default.strip() if default is not None else None)
+            if placeholder not in numbers:
+                numbers[placeholder] = len(self.placeholders)
+                self.placeholders.append(placeholder)
+            self.slots.append((len(self.pieces), numbers[placeholder]))
+            self.pieces.append(None)
+            position = match.end()
+        self.pieces.append(text[position:])
+        self.text = text
+        self.escape = escape
+
+    @property
+    def fields(self):
+        # Field name -> default, None if at least one placeholder has no default
+        fields = {}
+        for name, default in self.placeholders:
+            fields[name] = None if name in fields and fields[name] is None else default
+        return fields
+
+    def render(self, fields):
+        if not self.placeholders:
+            return self.text
+        fields = fields or {}
+        values = []
+        for name, default in self.placeholders:
+            value = fields.get(name)
+            if value and self.escape:
+                value = self.escape(value)
+            values.append(value or default or '')
+        pieces = self.pieces.copy()
+        for piece, value in self.slots:
+            pieces[piece] = values[value]
+        return ''.join(pieces)
+
+# Message bytes for one campaign. The MIME structure and attachments are encoded once; only the envelope
+# headers and, for personalized messages, the subject and body are rendered per recipient.
+class MessageTemplate:
+    def __init__(self, subject, message_text, attachments, cache=None):
+        from email.mime.application import MIMEApplication
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.text import MIMEText
+
+        # The body is always sent as HTML, so lead values like "Tom <Tom & Co>" are escaped there;
+        # the subject is a plain header
+        self.subject = MergeTemplate(subject)
+        self.message = MergeTemplate(message_text, escape=html.escape)
+        self.personalized = bool(self.subject.placeholders or self.message.placeholders)
+
+        msg = MIMEMultipart()
+        if self.message.placeholders:
+            # The body is base64-encoded per recipient and spliced in where the marker ends up
+            body_marker = f"BODY-{uuid.uuid4().hex}"
+            text_part = MIMEText('', 'html', 'utf-8')
+            text_part.set_payload(body_marker)
+            msg.attach(text_part)
+        else:
+            msg.attach(MIMEText(message_text, 'html'))
+
+        # Attachment parts get a marker as payload; the encoded contents, from the cache when available,
+        # are spliced in after generating, so the email package never copies or re-encodes them
+        attachment_markers = []
+        for attachment in attachments:
+            if not isinstance(attachment, Attachment):
+                attachment = Attachment.load(attachment)
+            part = MIMEApplication(b'', Name=attachment.name)
+            marker = f"ATTACHMENT-{uuid.uuid4().hex}"
+            part.set_payload(marker)
+            part['Content-Disposition'] = f'attachment; filename="{attachment.name}"'
+            msg.attach(part)
+            attachment_markers.append((marker.encode('ascii'), attachment))
+
+        # SMTP wants CRLF line endings and smtplib does not fix them up for bytes
+        self.policy = msg.policy.clone(linesep='\r\n')
+        headers, body = msg.as_bytes(policy=self.policy).split(b'\r\n\r\n', 1)
+        for marker, attachment in attachment_markers:
+            before, after = body.split(marker + b'\r\n', 1)
+            encoded = cache.get(attachment) if cache else attachment.encode()
+            body = b''.join((before, encoded, after))
+        self.mime_headers = headers + b'\r\n\r\n'
+        self.body = body
+        # Rough size of one rendered message, for sizing render queues
+        self.size = len(self.mime_headers) + len(body) + len(message_text.encode('utf-8')) * 4 // 3
+        if self.message.placeholders:
+            self.body_prefix, self.body_suffix = body.split(body_marker.encode('ascii'), 1)
+
+        # Without merge fields the subject is the same for everyone, so it is folded and encoded once as well
+        self.subject_header = self.encode_subject(subject)
+
+    def encode_subject(self, subject):
+        # ASCII subjects are sent as they are, like MIMEText with maxheaderlen=0 used to; only non-ASCII
+        # subjects and lines over the RFC 5322 limit of 998 characters go through the email package
+        subject = ' '.join(subject.splitlines())
+        if subject.isascii() and len(b'Subject: ') + len(subject) <= 998:
+            return b'Subject: ' + subject.encode('ascii') + b'\r\n'
+        from email.message import Message
+        header = Message()
+        header['Subject'] = subject
+        return header.as_bytes(policy=self.policy).rstrip(b'\r\n') + b'\r\n'
+
+    def encode_body(self, text):
+        return encode_base64_lines(text.encode('utf-8'))
+
+    def render(self, from_email, to_email, fields=None):
+        if self.personalized:
+            return self.with_sender(from_email, self.render_content(to_email, fields))
+        return b''.join((
+            b'From: ', from_email.encode('utf-8'), b'\r\n',
+            b'To: ', to_email.encode('utf-8'), b'\r\n',
+            self.subject_header,
+            self.mime_headers,
+            self.body,
+        ))
+
+    def render_content(self, to_email, fields=None):
+        # Everything but the From header, which depends on the SMTP account picked at send time
+        subject_header = self.subject_header
+        body = self.body
+        if self.subject.placeholders:
+            subject_header = self.encode_subject(self.subject.render(fields))
+        if self.message.placeholders:
+            body = b''.join((self.body_prefix, self.encode_body(self.message.render(fields)), self.body_suffix))
+        return b''.join((b'To: ', to_email.encode('utf-8'), b'\r\n', subject_header, self.mime_headers, body))
+
+    def with_sender(self, from_email, content):
+        return b''.join((b'From: ', from_email.encode('utf-8'), b'\r\n', content))
+
+    @staticmethod
+    def merge_fields(subject, message_text):
+        # Merge fields used by a campaign, for validating the leads before anything is built
+        fields = MergeTemplate(subject).fields
+        for name, default in MergeTemplate(message_text).fields.items():
+            fields[name] = None if name in fields and fields[name] is None else default
+        return fields
+
+# Renders personalized messages on worker threads ahead of the send loop. Batches go through a bounded
+# queue, so rendering overlaps with waiting on SMTP replies while memory stays around max_bytes.
+# Threads rather than processes: results are whole messages, and copying them back from another
+# process would cost more than rendering them.
+class RenderStage:
+    BATCH_SIZE = 32
+
+    def __init__(self, template, records, workers=2, max_bytes=64 * 1024 * 1024, metrics=None):
+        self.template = template
+        self.records = records
+        self.metrics = metrics
+        batches = max_bytes // max(1, template.size * self.BATCH_SIZE)
+        self.queue = queue.Queue(maxsize=max(2, min(64, batches)))
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='render')
+        self.closed = False
+        self.finished = False
+        self.feeder = threading.Thread(target=self.feed, daemon=True)
+        self.feeder.start()
+
+    def feed(self):
+        # Reads leads and hands out render jobs; put() blocks while the queue is full
+        try:
+            while not self.closed:
+                batch = list(itertools.islice(self.records, self.BATCH_SIZE))
+                if not batch:
+                    break
+                if not self.put(self.executor.submit(self.render_batch, batch)):
+                    return
+        except Exception as e:
+            # Reading the leads failed; the error is raised in the send loop
+            self.put(e)
+            return
+        self.put(None)
+
+    def put(self, item):
+        while not self.closed:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def render_batch(self, batch):
+        started = time.perf_counter()
+        rendered = []
+        for lead, fields in batch:
+            try:
+                content = self.template.render_content(lead, fields)
+            except Exception:
+                # Rendered again in the send loop, which reports the error for this recipient
+                content = None
+            rendered.append((lead, fields, content))
+        if self.metrics:
+            self.metrics.record('render', (time.perf_counter() - started) / len(batch))
+        return rendered
+
+    def next_batch(self):
+        # List of (lead, fields, content) in lead order, None once every lead has been handed out
+        if self.finished:
+            return None
+        item = self.queue.get()
+        if item is None:
+            self.finished = True
+            return None
+        if isinstance(item, Exception):
+            self.finished = True
+            raise item
+        return item.result()
+
+    def close(self):
+        self.closed = True
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+# Appends a gateway to an uploaded lead file in pandas chunks; the result is a new temporary lead file.
+# Extra columns (merge fields) are carried over, in which case the result is a CSV.
+def append_gateway_to_file(source, country, gateway, on_progress=None, chunk_size=200000):
+    import pandas as pd
+    columns = source.field_names
+    fd, output_path = temporary_lead_file('leads_gateway_', '.csv' if columns else '.txt')
+    records = source.records()
+    processed = 0
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as output:
+            writer = csv.writer(output)
+            if columns:
+                writer.writerow(['recipient'] + columns)
+            while True:
+                chunk = list(itertools.islice(records, chunk_size))
+                if not chunk:
+                    break
+                appended = append_gateway_bulk(pd.Series([lead for lead, _ in chunk], dtype=str), country, gateway)
+                if columns:
+                    # append_gateway_bulk keeps the index, so each address finds its row's fields
+                    writer.writerows([address] + [chunk[row][1].get(name, '') for name in columns]
+                                     for row, address in appended.items())
+                elif len(appended):
+                    output.write('\n'.join(appended))
+                    output.write('\n')
+                processed += len(chunk)
+                if on_progress:
+                    on_progress(processed)
+    except Exception:
+        LeadSource(output_path).discard()
+        raise
+    return LeadSource(output_path)
+
+# Same as append_gateway_to_file for a list of leads held in memory
+def append_gateway_to_list(leads, country, gateway):
+    import pandas as pd
+    return list(append_gateway_bulk(pd.Series(leads, dtype=str), country, gateway))
+
+# Runs the LeadChecker pass; uploaded files are filtered into a temporary file, lists stay lists.
+# merge_fields (see MessageTemplate.merge_fields) are validated here so a missing column stops the run before sending.
+def check_leads(leads, merge_fields=None):
+    merge_fields = merge_fields or {}
+    columns = leads.field_names if isinstance(leads, LeadSource) and merge_fields else []
+    required = [name for name, default in merge_fields.items() if default is None]
+    missing = [name for name in required if name not in columns]
+    if missing:
+        raise ValueError(f"The message uses merge fields that are not lead columns: {', '.join(missing)}. "
+                         f"Upload a CSV or Excel file with these columns, or give them a default like "
+                         f"{{{{{missing[0]}|default}}}}.")
+
+    checker = LeadChecker(required_fields=required)
+    if not isinstance(leads, LeadSource):
+        return list(checker.iter_valid(leads)), checker.stats
+
+    # The caller owns the filtered file and discards it once the run is over
+    fd, output_path = temporary_lead_file('leads_checked_', '.csv' if columns else '.txt')
+    try:
+        if columns:
+            # The extra columns are kept, so the filtered file is a CSV with the lead in a 'recipient' column
+            with os.fdopen(fd, 'w', encoding='utf-8', newline='') as output:
+                writer = csv.writer(output)
+                writer.writerow(['recipient'] + columns)
+                for lead, fields in checker.iter_valid_records(leads.records()):
+                    writer.writerow([lead] + [fields.get(name, '') for name in columns])
+        else:
+            with os.fdopen(fd, 'w', encoding='utf-8') as output:
+                for lead in checker.iter_valid(leads):
+                    output.write(lead + '\n')
+    except Exception:
+        LeadSource(output_path).discard()
+        raise
+    checked = LeadSource(output_path)
+    checked.count = checker.stats['accepted']
+    return checked, checker.stats
+
+# Streams filtered log rows to a CSV or JSONL file (picked by extension), returns the row count
+def export_logs(path, filters, store_path='email_logs.db'):
+    store = LogStore(store_path)
+    count = 0
+    try:
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            rows = store.iter_rows(**filters)
+            if path.lower().endswith('.jsonl'):
+                for row in rows:
+                    f.write(json.dumps(dict(zip(LogStore.COLUMNS, row))) + '\n')
+                    count += 1
+            else:
+                writer = csv.writer(f)
+                writer.writerow(LogStore.COLUMNS)
+                for row in rows:
+                    writer.writerow(row)
+                    count += 1
+    finally:
+        store.close()
+    return count
+
+# Saved SMTP configurations
+def load_smtp_details(path='smtp_details.json'):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+def save_smtp_details(smtp_details, path='smtp_details.json'):
+    with open(path, 'w') as f:
+        json.dump(smtp_details, f)
+
+# Receives a CampaignSender's events; the GUI forwards them to Qt signals, the CLI prints them
+class CampaignListener:
+    def on_progress(self, percent):
+        pass
+
+    def on_status(self, message):
+        pass
+
+    # Per-recipient events arrive in batches, at most every CampaignSender.EVENT_INTERVAL seconds
+    def on_status_batch(self, messages):
+        pass
+
+    def on_log_batch(self, entries):
+        pass
+
+    def on_rate(self, per_minute):
+        pass
+
+    def on_metrics(self, snapshot):
+        pass
+
+    def on_finished(self, success, message):
+        pass
+
+# Sends one campaign, one message at a time; runs on whatever thread calls run()
+class CampaignSender:
+    EVENT_INTERVAL = 0.25
+    METRICS_FILE_INTERVAL = 5
+    RENDER_WORKERS = 2
+    POLL_INTERVAL = 0.05  # Longest single sleep, so Pause and Stop stay responsive
+
+    def __init__(self, smtp_details, message_text, leads, rotate_count, subject, speed_value, speed_unit, attachments, suppression_path='suppression.db', attachment_cache_path='attachment_cache', journal_path=None, log_writer=None, profile=False, listener=None, pool=None, rate_limiter=None, retry_options=None, breaker_options=None):
+        self.listener = listener or CampaignListener()
+        self.smtp_details = smtp_details
+        self.message_text = message_text
+        self.leads = leads
+        self.rotate_count = rotate_count
+        self.subject = subject
+        self.speed_value = speed_value
+        self.speed_unit = speed_unit
+        self.attachments = attachments
+        self.suppression_path = suppression_path
+        self.attachment_cache_path = attachment_cache_path
+        self.journal_path = journal_path or CampaignJournal.new_path()
+        self.campaign_id = os.path.splitext(os.path.basename(self.journal_path))[0]
+        self.log_writer = log_writer
+        self.profile = profile
+        # A CampaignQueue passes its SMTP pool and this campaign's share of the rate limits
+        self.shared_pool = pool
+        self.shared_limiter = rate_limiter
+        # RetryQueue and CircuitBreaker arguments (delays, attempts, thresholds), their defaults otherwise
+        self.retry_options = retry_options or {}
+        self.breaker_options = breaker_options or {}
+        # Campaign time: rate limits, retry delays, cooldowns and the achieved rate all go by this clock
+        self.clock = self.create_clock()
+        self.metrics = SendMetrics(self.clock)
+        self.metrics_path = os.path.splitext(self.journal_path)[0] + '.metrics.json'
+        self.metrics_written = time.monotonic()
+        self.paused = False
+        self.stop_event = threading.Event()
+        self.rate_meter = RateMeter(clock=self.clock)
+        self.rate_emitted = 0
+        self.pending_status = []
+        self.pending_logs = []
+        self.pending_progress = 0
+        self.emitted_progress = 0
+        self.flushed_at = 0
+
+    def run(self):
+        if not self.profile:
+            self.run_campaign()
+            return
+
+        # cProfile only sees this thread; the asyncio engine's executor threads are not included
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            self.run_campaign()
+        finally:
+            profiler.disable()
+            profile_path = os.path.splitext(self.journal_path)[0] + '.prof'
+            profiler.dump_stats(profile_path)
+            self.listener.on_status(f"Profile written to {profile_path}")
+
+    def run_campaign(self):
+        # Body and attachments are encoded once for the whole campaign, attachments usually from the cache.
+        # Files are checked again in case they changed or went missing since they were added.
+        try:
+            attachments = check_attachments(self.attachments)
+            template = MessageTemplate(self.subject, self.message_text, attachments,
+                                       AttachmentCache(self.attachment_cache_path))
+        except (OSError, ValueError) as e:
+            self.listener.on_finished(False, f"Failed to build message: {e}")
+            return
+
+        pool = self.create_pool()
+        self.suppression = SuppressionStore(self.suppression_path)
+        self.journal = self.open_journal()
+        if self.journal.done:
+            self.listener.on_status(f"Resuming campaign: {len(self.journal.done)} recipients already done")
+        # Servers with an open circuit are left out of the rotation; temporary failures are retried later
+        self.scheduler = SMTPScheduler(self.smtp_details, self.rotate_count, clock=self.clock, **self.breaker_options)
+        self.retries = RetryQueue(clock=self.clock, **self.retry_options)
+        self.render_stage = None
+        try:
+            limiter = self.shared_limiter or RateLimiter(self.speed_value, self.speed_unit, self.smtp_details, clock=self.clock)
+            self.send_all(pool, template, limiter)
+        finally:
+            if self.render_stage:
+                self.render_stage.close()
+            pool.close()
+            self.suppression.close()
+            self.journal.close()
+
+    def create_clock(self):
+        return time.monotonic
+
+    def create_pool(self):
+        # Sessions are reused across recipients and closed when the run ends
+        if self.shared_pool is not None:
+            return self.shared_pool.view(self.metrics)
+        return SMTPConnectionPool(metrics=self.metrics)
+
+    def open_journal(self):
+        # Reopening an existing journal resumes the campaign; recipients already done are skipped
+        return CampaignJournal(self.journal_path, self.subject)
+
+    def sleep(self, seconds):
+        # Callers loop until whatever they wait for is ready, so a short sleep is enough
+        self.stop_event.wait(min(seconds, self.POLL_INTERVAL))
+
+    def send_all(self, pool, template, limiter):
+        counts = {'success': 0, 'failed': 0, 'skipped': 0, 'resumed': 0}
+        total_leads = len(self.leads)
+        # Leads may be a plain list or a LeadSource streaming them (and their merge fields) from disk
+        records = itertools.chain.from_iterable(iter(self.lead_batches(template), None))
+
+        while not self.stop_requested():
+            # Retries that are due go before new leads
+            retry = self.retries.pop_due()
+            if retry:
+                (lead, fields), attempt = retry
+                content = None
+            else:
+                record = next(records, None)
+                if record is None:
+                    if not self.retries:
+                        break
+                    self.wait_for_retries()
+                    continue
+                lead, fields, content = record
+                attempt = 0
+
+                if lead in self.journal.done:
+                    counts['resumed'] += 1
+                    continue
+
+                if self.suppression.contains(lead):
+                    self.report_skipped(lead)
+                    counts['skipped'] += 1
+                    self.set_progress(sum(counts.values()), total_leads)
+                    continue
+
+            # Waits while every server is out of the schedule, probing them as their cooldowns end
+            smtp_index = self.wait_for_server(pool, limiter)
+            if smtp_index is None:
+                break
+            smtp = self.smtp_details[smtp_index]
+
+            # Waits out pauses and the speed limit, returns False once stop is requested
+            if not self.wait_for_slot(limiter, smtp_index):
+                break
+
+            try:
+                message = self.build_message(template, smtp, lead, fields, content)
+                pool.sendmail(smtp, smtp['from_email'], lead, message)
+                error = None
+            except Exception as e:
+                error = e
+
+            outcome = self.settle(lead, fields, attempt + 1, smtp_index, error)
+            if outcome != 'deferred':
+                counts[outcome] += 1
+                self.set_progress(sum(counts.values()), total_leads)
+
+        self.flush_events(force=True)
+        self.finish(counts)
+
+    def lead_batches(self, template):
+        # Returns a function handing out the next batch of (lead, fields, content), None at the end.
+        # Personalized messages come pre-rendered from a RenderStage; otherwise content is None and the
+        # send loop renders the message itself, which is a single join.
+        records = lead_records(self.leads, template.personalized)
+        if template.personalized:
+            self.render_stage = RenderStage(template, records, workers=self.RENDER_WORKERS, metrics=self.metrics)
+            return self.render_stage.next_batch
+
+        def next_batch():
+            batch = [(lead, fields, None) for lead, fields in itertools.islice(records, RenderStage.BATCH_SIZE)]
+            return batch or None
+        return next_batch
+
+    def build_message(self, template, smtp, lead, fields, content):
+        with self.metrics.timer('build'):
+            if content is None:
+                return template.render(smtp['from_email'], lead, fields)
+            return template.with_sender(smtp['from_email'], content)
+
+    def finish(self, counts):
+        summary = f"{counts['success']} sent, {counts['failed']} failed, {counts['skipped']} skipped{self.resumed_summary()}"
+        if self.scheduler.exhausted():
+            # Leads that were never tried are not in the journal, so resuming the campaign picks them up
+            self.listener.on_finished(False, f"Stopped: no SMTP server is accepting mail ({summary})")
+            return
+        self.listener.on_finished(True, f"Completed: {summary}")
+
+    def settle(self, lead, fields, attempts, smtp_index, error):
+        # Records one try; returns 'success', 'failed', or 'deferred' when it went on the retry queue
+        smtp = self.smtp_details[smtp_index]
+        kind = None if error is None else classify_failure(error)
+        breaker = self.scheduler.breakers[smtp_index]
+        if kind == 'server':
+            if breaker.record_failure():
+                self.listener.on_status(f"{smtp['username']} ({smtp['sender_name']}) taken out of rotation after "
+                                        f"{breaker.failures} failures, next check in {breaker.cooldown:.0f}s")
+        else:
+            breaker.record_success()
+
+        if kind in ('server', 'transient'):
+            delay = self.retries.push((lead, fields), attempts)
+            if delay is not None:
+                self.report_deferred(lead, smtp, error, attempts, delay)
+                return 'deferred'
+        return 'success' if self.report(lead, smtp, error) else 'failed'
+
+    def wait_for_server(self, pool, limiter):
+        while not self.stop_requested() and not self.scheduler.exhausted():
+            for smtp_index in self.scheduler.due_probes():
+                self.scheduler.breakers[smtp_index].probe_started()
+                self.finish_probe(smtp_index, pool.probe(self.smtp_details[smtp_index]))
+            # A server at its hourly limit is passed over rather than holding up the others
+            smtp_index = self.scheduler.pick(limiter.smtp_delay)
+            if smtp_index is not None:
+                return smtp_index
+            self.flush_events()
+            self.sleep(self.POLL_INTERVAL)
+        return None
+
+    def finish_probe(self, smtp_index, error):
+        smtp = self.smtp_details[smtp_index]
+        breaker = self.scheduler.breakers[smtp_index]
+        breaker.probe_finished(error is None)
+        if error is None:
+            self.listener.on_status(f"{smtp['username']} ({smtp['sender_name']}) is back in rotation")
+        elif breaker.state == CircuitBreaker.FAILED:
+            self.listener.on_status(f"{smtp['username']} ({smtp['sender_name']}) still failing ({error}), "
+                                    f"not used for the rest of this campaign")
+        else:
+            self.listener.on_status(f"{smtp['username']} ({smtp['sender_name']}) still failing ({error}), "
+                                    f"next check in {breaker.cooldown:.0f}s")
+
+    def wait_for_retries(self):
+        # Only retries are left; sleep until the next one is due
+        self.flush_events()
+        self.sleep(max(0, self.retries.next_due() - self.clock()))
+
+    def wait_for_slot(self, limiter, smtp_index):
+        # Short sleeps keep Pause and Stop responsive while waiting for a send token
+        while not self.stop_requested():
+            self.flush_events()
+            if self.paused:
+                self.sleep(self.POLL_INTERVAL)
+                continue
+            wait = limiter.reserve(smtp_index)
+            if wait == 0:
+                return True
+            self.sleep(wait)
+        return False
+
+    def resumed_summary(self):
+        return f", {len(self.journal.done)} already done" if self.journal.done else ""
+
+    def report_skipped(self, lead):
+        self.journal.record('Skipped', lead)
+        status = f"Skipped {lead}: on the suppression list"
+        self.queue_event(status, {
+            'recipient': lead,
+            'status': 'Skipped',
+            'smtp': '',
+            'message': status
+        })
+
+    def report_deferred(self, lead, smtp, error, attempts, delay):
+        self.metrics.record_error(smtp, error)
+        status = (f"Failed to send to {lead}: {error} with {smtp['username']} ({smtp['sender_name']}), "
+                  f"retrying in {delay:.0f}s (attempt {attempts} of {self.retries.max_attempts})")
+        self.queue_event(status, {
+            'recipient': lead,
+            'status': 'Deferred',
+            'smtp': f"{smtp['username']} ({smtp['sender_name']})",
+            'message': status
+        })
+
+    def report(self, lead, smtp, error):
+        # Queues the status and log entry for one recipient, returns True on success
+        self.journal.record('Success' if error is None else 'Failed', lead)
+        if error is not None and is_permanent_recipient_failure(error):
+            self.suppression.add(lead, f"permanent failure: {error}")
+        self.rate_meter.record()
+        if error is None:
+            self.metrics.record_message()
+        else:
+            self.metrics.record_error(smtp, error)
+        if error is None:
+            status = f"Sent to {lead}: Success with {smtp['username']} ({smtp['sender_name']})"
+        else:
+            status = f"Failed to send to {lead}: {error} with {smtp['username']} ({smtp['sender_name']})"
+        self.queue_event(status, {
+            'recipient': lead,
+            'status': 'Success' if error is None else 'Failed',
+            'smtp': f"{smtp['username']} ({smtp['sender_name']})",
+            'message': status
+        })
+        return error is None
+
+    def queue_event(self, status, log_entry):
+        self.pending_status.append(status)
+        self.pending_logs.append(log_entry)
+        self.flush_events()
+
+    def set_progress(self, done, total):
+        self.pending_progress = int(done / total * 100)
+        self.flush_events()
+
+    def flush_events(self, force=False):
+        # Emits everything queued since the last flush, at most once per EVENT_INTERVAL
+        now = time.monotonic()
+        if not force and now - self.flushed_at < self.EVENT_INTERVAL:
+            return
+        self.flushed_at = now
+        if self.pending_status:
+            if self.log_writer:
+                self.log_writer.write(self.campaign_id, self.pending_logs)
+            self.listener.on_status_batch(self.pending_status)
+            self.listener.on_log_batch(self.pending_logs)
+            self.pending_status = []
+            self.pending_logs = []
+        if self.pending_progress != self.emitted_progress:
+            self.emitted_progress = self.pending_progress
+            self.listener.on_progress(self.pending_progress)
+        if force or now - self.rate_emitted >= 1:
+            self.rate_emitted = now
+            self.listener.on_rate(self.rate_meter.per_minute())
+            self.listener.on_metrics(self.metrics.snapshot())
+        if self.metrics_path and (force or now - self.metrics_written >= self.METRICS_FILE_INTERVAL):
+            self.metrics_written = now
+            try:
+                self.metrics.write(self.metrics_path)
+            except OSError as e:
+                self.listener.on_status(f"Could not write metrics file: {e}")
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+    def stop(self):
+        # Safe to call from any thread; the send loop notices within milliseconds
+        self.stop_event.set()
+
+    def stop_requested(self):
+        return self.stop_event.is_set()
+
+# Asyncio engine keeping up to max_in_flight messages in flight per SMTP server
+class AsyncCampaignSender(CampaignSender):
+    def __init__(self, *args, max_in_flight=4, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_in_flight = max_in_flight
+
+    def send_all(self, pool, template, limiter):
+        import asyncio
+        asyncio.run(self.send_all_async(pool, template, limiter))
+
+    async def wait_for_slot_async(self, limiter, smtp_index):
+        import asyncio
+        while not self.stop_requested():
+            if self.paused:
+                await asyncio.sleep(0.05)
+                continue
+            wait = limiter.reserve(smtp_index)
+            if wait == 0:
+                return True
+            await asyncio.sleep(min(wait, 0.05))
+        return False
+
+    async def wait_for_server_async(self, pool, executor, limiter):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        while not self.stop_requested() and not self.scheduler.exhausted():
+            # Probes run on the executor so sends to healthy servers carry on meanwhile
+            for smtp_index in self.scheduler.due_probes():
+                self.scheduler.breakers[smtp_index].probe_started()
+                probe = loop.run_in_executor(executor, pool.probe, self.smtp_details[smtp_index])
+                probe.add_done_callback(lambda future, smtp_index=smtp_index: self.finish_probe(smtp_index, future.result()))
+            smtp_index = self.scheduler.pick(limiter.smtp_delay)
+            if smtp_index is not None:
+                return smtp_index
+            await asyncio.sleep(0.05)
+        return None
+
+    async def send_all_async(self, pool, template, limiter):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        # smtplib is blocking, so every message in flight (and every probe) occupies one executor thread
+        executor = ThreadPoolExecutor(max_workers=(self.max_in_flight + 1) * len(self.smtp_details))
+        slots = [asyncio.Semaphore(self.max_in_flight) for _ in self.smtp_details]
+        counts = {'success': 0, 'failed': 0, 'skipped': 0, 'resumed': 0}
+        total_leads = len(self.leads)
+        pending = set()
+
+        async def send_one(lead, fields, content, attempt, smtp_index):
+            smtp = self.smtp_details[smtp_index]
+            try:
+                message = self.build_message(template, smtp, lead, fields, content)
+                await loop.run_in_executor(executor, pool.sendmail, smtp, smtp['from_email'], lead, message)
+                error = None
+            except Exception as e:
+                error = e
+            finally:
+                slots[smtp_index].release()
+
+            outcome = self.settle(lead, fields, attempt + 1, smtp_index, error)
+            if outcome != 'deferred':
+                counts[outcome] += 1
+                self.set_progress(sum(counts.values()), total_leads)
+
+        async def flush_periodically():
+            # The loop may sit waiting on sends, so batches are flushed on a timer as well
+            while True:
+                await asyncio.sleep(self.EVENT_INTERVAL)
+                self.flush_events()
+
+        # Batches are fetched on the default executor, so reading leads and waiting on the render
+        # stage never blocks the event loop
+        next_batch = self.lead_batches(template)
+        batch = deque()
+        flusher = asyncio.create_task(flush_periodically())
+        try:
+            while not self.stop_requested():
+                # Retries that are due go before new leads
+                retry = self.retries.pop_due()
+                if retry:
+                    (lead, fields), attempt = retry
+                    content = None
+                else:
+                    if not batch and next_batch:
+                        fetched = await loop.run_in_executor(None, next_batch)
+                        if fetched is None:
+                            next_batch = None
+                        else:
+                            batch.extend(fetched)
+                    if not batch:
+                        # Sends still in flight may add retries, so the loop only ends once both are done
+                        if not self.retries and not pending:
+                            break
+                        await asyncio.sleep(0.05)
+                        continue
+                    lead, fields, content = batch.popleft()
+                    attempt = 0
+
+                    if lead in self.journal.done:
+                        counts['resumed'] += 1
+                        continue
+
+                    if self.suppression.contains(lead):
+                        self.report_skipped(lead)
+                        counts['skipped'] += 1
+                        self.set_progress(sum(counts.values()), total_leads)
+                        continue
+
+                smtp_index = await self.wait_for_server_async(pool, executor, limiter)
+                if smtp_index is None:
+                    break
+
+                # Wait for a free slot on this server, keeping the rotation order intact
+                await slots[smtp_index].acquire()
+                if not await self.wait_for_slot_async(limiter, smtp_index):
+                    slots[smtp_index].release()
+                    break
+                task = asyncio.create_task(send_one(lead, fields, content, attempt, smtp_index))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+
+            if pending:
+                await asyncio.gather(*pending)
+        finally:
+            flusher.cancel()
+            executor.shutdown(wait=True)
+
+        self.flush_events(force=True)
+        self.finish(counts)
+
+# One campaign in a CampaignQueue; also the listener its sender reports to, so a front end
+# can poll CampaignQueue.snapshot() instead of wiring up every campaign
+class QueuedCampaign(CampaignListener):
+    QUEUED = 'Queued'
+    RUNNING = 'Running'
+    PAUSED = 'Paused'
+    CANCELLING = 'Cancelling'
+    COMPLETED = 'Completed'
+    FAILED = 'Failed'
+    CANCELLED = 'Cancelled'
+
+    def __init__(self, name, priority, sender_class, settings):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.priority = priority
+        self.sender_class = sender_class
+        self.settings = settings
+        self.state = self.QUEUED
+        self.sender = None
+        self.share = None
+        self.thread = None
+        self.progress = 0
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.rate = 0.0
+        self.message = ''
+        self.succeeded = False
+
+    def on_progress(self, percent):
+        self.progress = percent
+
+    def on_status(self, message):
+        self.message = message
+
+    def on_status_batch(self, messages):
+        self.message = messages[-1]
+
+    def on_log_batch(self, entries):
+        for entry in entries:
+            if entry['status'] == 'Success':
+                self.sent += 1
+            elif entry['status'] == 'Failed':
+                self.failed += 1
+            elif entry['status'] == 'Skipped':
+                self.skipped += 1
+
+    def on_rate(self, per_minute):
+        self.rate = per_minute
+
+    def on_finished(self, success, message):
+        self.message = message
+        self.succeeded = success
+
+# Runs several campaigns at once through one SMTP pool and one set of per-SMTP rate limits.
+# Up to max_running campaigns send at a time, highest priority first, each on its own thread;
+# the rest wait their turn. Priority is also the campaign's weight when the rate limits are contended.
+class CampaignQueue:
+    PRIORITIES = {'Low': 1, 'Normal': 2, 'High': 4}
+
+    def __init__(self, smtp_details, max_running=3, log_writer=None):
+        self.smtp_details = smtp_details
+        self.max_running = max_running
+        self.log_writer = log_writer
+        self.lock = threading.Lock()
+        self.campaigns = []
+        # Created when the first campaign starts and dropped when the last one ends, so campaigns
+        # always run against the SMTP list as it was when the queue became busy
+        self.pool = None
+        self.limiter = None
+        self.active_smtp = None
+        self.attached = []  # Shares of campaigns run outside the queue, see attach
+
+    # settings are CampaignSender arguments other than smtp_details, leads included
+    def add(self, name, settings, priority=PRIORITIES['Normal'], sender_class=CampaignSender):
+        campaign = QueuedCampaign(name, priority, sender_class, settings)
+        with self.lock:
+            self.campaigns.append(campaign)
+        self.schedule()
+        return campaign
+
+    def get(self, campaign_id):
+        with self.lock:
+            return next((campaign for campaign in self.campaigns if campaign.id == campaign_id), None)
+
+    def schedule(self):
+        # Starts waiting campaigns while there are free slots. Paused campaigns don't hold one; once
+        # resumed they wait here like the others, so no more than max_running ever send at once.
+        with self.lock:
+            running = sum(1 for campaign in self.campaigns if campaign.state == QueuedCampaign.RUNNING)
+            waiting = sorted((campaign for campaign in self.campaigns if campaign.state == QueuedCampaign.QUEUED),
+                             key=lambda campaign: -campaign.priority)
+            starting = waiting[:max(0, self.max_running - running)]
+            if starting:
+                self.open_shared()
+            for campaign in starting:
+                if campaign.sender:
+                    # Started before, paused and resumed: its thread is waiting for the slot
+                    campaign.sender.resume()
+                    campaign.state = QueuedCampaign.RUNNING
+                    continue
+                campaign.share = self.limiter.join(campaign.settings['speed_value'], campaign.settings['speed_unit'],
+                                                   campaign.priority)
+                try:
+                    campaign.sender = campaign.sender_class(smtp_details=self.active_smtp, log_writer=self.log_writer,
+                                                            listener=campaign, pool=self.pool,
+                                                            rate_limiter=campaign.share, **campaign.settings)
+                except (OSError, ValueError) as e:
+                    self.limiter.leave(campaign.share)
+                    campaign.share = None
+                    discard_leads(campaign.settings['leads'])
+                    campaign.message = f"Campaign failed: {e}"
+                    campaign.state = QueuedCampaign.FAILED
+                    continue
+                campaign.state = QueuedCampaign.RUNNING
+                campaign.thread = threading.Thread(target=self.run, args=(campaign,), daemon=True)
+                campaign.thread.start()
+            idle_pool = self.release_shared()
+        if idle_pool:
+            idle_pool.close()
+
+    def open_shared(self):
+        # Called with the lock held
+        if self.pool is None:
+            self.active_smtp = list(self.smtp_details)
+            self.pool = SMTPConnectionPool()
+            self.limiter = SharedRateLimiter(self.active_smtp)
+
+    def release_shared(self):
+        # Called with the lock held; returns the pool to close once nothing sends through it
+        if self.pool is None or self.attached or any(campaign.share for campaign in self.campaigns):
+            return None
+        idle_pool = self.pool
+        self.pool = self.limiter = self.active_smtp = None
+        return idle_pool
+
+    # A campaign run outside the queue (the GUI's single campaign) sends through the same SMTP
+    # accounts, so it takes a share of the same pool and rate limits instead of pacing itself.
+    # Returns the SMTP list, pool and share to give its sender; detach when the run is over.
+    def attach(self, speed_value, speed_unit, priority=PRIORITIES['Normal']):
+        with self.lock:
+            self.open_shared()
+            share = self.limiter.join(speed_value, speed_unit, priority)
+            self.attached.append(share)
+            return self.active_smtp, self.pool, share
+
+    def detach(self, share):
+        with self.lock:
+            if share not in self.attached:
+                return
+            self.attached.remove(share)
+            self.limiter.leave(share)
+            idle_pool = self.release_shared()
+        if idle_pool:
+            idle_pool.close()
+
+    def run(self, campaign):
+        try:
+            campaign.sender.run()
+        except Exception as e:
+            campaign.on_finished(False, f"Campaign failed: {e}")
+        # The queue owns each campaign's checked leads, see check_leads
+        discard_leads(campaign.settings['leads'])
+        with self.lock:
+            self.limiter.leave(campaign.share)
+            campaign.share = None
+            if campaign.state == QueuedCampaign.CANCELLING:
+                campaign.state = QueuedCampaign.CANCELLED
+            elif campaign.succeeded:
+                campaign.state = QueuedCampaign.COMPLETED
+            else:
+                campaign.state = QueuedCampaign.FAILED
+        self.schedule()
+
+    def pause(self, campaign):
+        with self.lock:
+            if campaign.state == QueuedCampaign.RUNNING:
+                campaign.sender.pause()
+                campaign.state = QueuedCampaign.PAUSED
+            elif campaign.state == QueuedCampaign.QUEUED:
+                campaign.state = QueuedCampaign.PAUSED
+        self.schedule()
+
+    def resume(self, campaign):
+        with self.lock:
+            if campaign.state == QueuedCampaign.PAUSED:
+                campaign.state = QueuedCampaign.QUEUED
+        self.schedule()
+
+    def cancel(self, campaign):
+        with self.lock:
+            if campaign.share and campaign.state != QueuedCampaign.CANCELLING:
+                # Its thread is running; the sender leaves its wait loops as soon as stop is set, paused or not
+                campaign.sender.stop()
+                campaign.state = QueuedCampaign.CANCELLING
+            elif campaign.state in (QueuedCampaign.QUEUED, QueuedCampaign.PAUSED):
+                campaign.state = QueuedCampaign.CANCELLED
+                discard_leads(campaign.settings['leads'])
+        self.schedule()
+
+    def remove_finished(self):
+        with self.lock:
+            self.campaigns = [campaign for campaign in self.campaigns if campaign.state not in (
+                QueuedCampaign.COMPLETED, QueuedCampaign.FAILED, QueuedCampaign.CANCELLED)]
+
+    def busy(self):
+        with self.lock:
+            return any(campaign.state in (QueuedCampaign.QUEUED, QueuedCampaign.RUNNING, QueuedCampaign.PAUSED,
+                                          QueuedCampaign.CANCELLING) for campaign in self.campaigns)
+
+    def stop_all(self, timeout=10):
+        # Cancels everything and waits up to timeout seconds for running campaigns to flush their
+        # last events (log rows, journal, metrics file); returns False if some are still running
+        with self.lock:
+            campaigns = list(self.campaigns)
+        for campaign in campaigns:
+            self.cancel(campaign)
+        deadline = time.monotonic() + timeout
+        for campaign in campaigns:
+            if campaign.thread:
+                campaign.thread.join(max(0, deadline - time.monotonic()))
+        return not any(campaign.thread and campaign.thread.is_alive() for campaign in campaigns)
+
+    def snapshot(self):
+        with self.lock:
+            return [{
+                'id': campaign.id,
+                'name': campaign.name,
+                'priority': campaign.priority,
+                'state': campaign.state,
+                'progress': campaign.progress,
+                'sent': campaign.sent,
+                'failed': campaign.failed,
+                'skipped': campaign.skipped,
+                'rate': campaign.rate,
+                'message': campaign.message,
+            } for campaign in self.campaigns]
+
+# Campaign time for dry runs: starts at zero and only moves when the simulation advances it
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        # A wait shorter than the clock's resolution at this time must still move it, or a bucket a rounding
+        # error short of a token is asked again at the same moment forever
+        if seconds > 0:
+            self.now = max(self.now + seconds, math.nextafter(self.now, math.inf))
+
+    def advance_to(self, moment):
+        self.now = max(self.now, moment)
+
+# Stands in for SMTPConnectionPool in dry runs: nothing is sent, each message takes a modelled time on
+# the virtual clock (connect once per server, then latency plus transfer time) and per-server load is
+# recorded. max_in_flight=None models the one-at-a-time engine, a number the asyncio engine's slots.
+class SimulatedSMTPPool:
+    def __init__(self, clock, latency=0.3, connect_latency=1.0, bandwidth=2 * 1024 * 1024, failure_rate=0.0,
+                 max_in_flight=None, seed=None):
+        self.clock = clock
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.bandwidth = bandwidth  # Bytes per second
+        self.failure_rate = failure_rate  # Fraction of sends answered with a temporary 451
+        self.max_in_flight = max_in_flight
+        self.random = random.Random(seed)
+        self.load = {}  # Server label -> messages, bytes and seconds busy sending
+        self.slots = {}  # Server label -> heap of the times its in-flight slots free up
+        self.finished_at = 0.0
+        self.slot_wait = 0.0  # Time spent waiting for a free slot
+
+    def sendmail(self, smtp, from_email, to_email, message):
+        label = SendMetrics.server_label(smtp)
+        load = self.load.get(label)
+        if load is None:
+            load = self.load[label] = {'messages': 0, 'bytes': 0, 'busy': 0.0}
+            duration = self.connect_latency
+        else:
+            duration = 0.0
+        duration += self.latency + len(message) / self.bandwidth
+        load['messages'] += 1
+        load['bytes'] += len(message)
+        load['busy'] += duration
+
+        if self.max_in_flight is None:
+            # Blocking send, like the one-at-a-time engine
+            self.clock.advance(duration)
+        else:
+            slots = self.slots.setdefault(label, [0.0] * self.max_in_flight)
+            free_at = heapq.heappop(slots)
+            if free_at > self.clock():
+                self.slot_wait += free_at - self.clock()
+                self.clock.advance_to(free_at)
+            heapq.heappush(slots, self.clock() + duration)
+        self.finished_at = max(self.finished_at, self.clock() + (0 if self.max_in_flight is None else duration))
+
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            raise smtplib.SMTPResponseException(451, b'Simulated temporary failure')
+
+    def probe(self, smtp):
+        return None
+
+    def close(self):
+        pass
+
+# Nothing is written during a dry run; a resumed campaign's journal is only read
+class DryRunJournal(CampaignJournal):
+    def __init__(self, path=None):
+        self.path = path
+        self.done = set()
+        if path:
+            self.load()
+
+    def record(self, status, lead):
+        pass
+
+    def close(self):
+        pass
+
+# Runs the real send loop (lead streaming, suppression checks, scheduling, rate limits, retries and
+# rendering) against SimulatedSMTPPool on a VirtualClock, so hours of rate-limited sending finish in
+# seconds. Reports the projected duration, the load on each server and what limited the speed.
+class SimulatedCampaignSender(CampaignSender):
+    WAIT_CAUSES = {
+        'speed_limit': 'the speed limit',
+        'smtp_limit': 'the per-SMTP hourly limits',
+        'sending': 'the SMTP servers themselves',
+        'retries': 'waiting to retry failed sends',
+        'servers': 'servers out of rotation',
+    }
+    ADVICE = {
+        'speed_limit': 'raise the speed to finish sooner',
+        'smtp_limit': 'add SMTP servers or raise their max sends per hour',
+        'sending': 'allow more concurrent sends per SMTP or add servers',
+        'retries': 'check the servers answering with temporary failures',
+        'servers': 'check the servers being taken out of rotation',
+    }
+
+    def __init__(self, *args, max_in_flight=None, latency=0.3, connect_latency=1.0, bandwidth=2 * 1024 * 1024,
+                 failure_rate=0.0, journal_path=None, **kwargs):
+        self.resume_path = journal_path
+        super().__init__(*args, journal_path=journal_path or 'dry-run.journal', **kwargs)
+        self.metrics_path = None
+        self.pool = SimulatedSMTPPool(self.clock, latency, connect_latency, bandwidth, failure_rate,
+                                      max_in_flight if max_in_flight and max_in_flight > 1 else None)
+        self.waits = dict.fromkeys(self.WAIT_CAUSES, 0.0)
+
+    def create_clock(self):
+        return VirtualClock()
+
+    def create_pool(self):
+        return self.pool
+
+    def open_journal(self):
+        return DryRunJournal(self.resume_path)
+
+    def sleep(self, seconds):
+        self.clock.advance(seconds)
+
+    def wait_for_slot(self, limiter, smtp_index):
+        # No pausing in a dry run; each wait is put down to the bucket that caused it
+        while not self.stop_requested():
+            wait = limiter.reserve(smtp_index)
+            if wait == 0:
+                return True
+            bucket = limiter.smtp_buckets[smtp_index]
+            self.waits['smtp_limit' if bucket and bucket.delay() >= wait else 'speed_limit'] += wait
+            self.sleep(wait)
+        return False
+
+    def wait_for_retries(self):
+        started = self.clock()
+        super().wait_for_retries()
+        self.waits['retries'] += self.clock() - started
+
+    def wait_for_server(self, pool, limiter):
+        started = self.clock()
+        smtp_index = super().wait_for_server(pool, limiter)
+        self.waits['servers'] += self.clock() - started
+        return smtp_index
+
+    def queue_event(self, status, log_entry):
+        # Per-recipient events would only describe sends that never happened
+        pass
+
+    def report(self, lead, smtp, error):
+        self.rate_meter.record()
+        if error is None:
+            self.metrics.record_message()
+        else:
+            self.metrics.record_error(smtp, error)
+        return error is None
+
+    def finish(self, counts):
+        duration = max(self.clock(), self.pool.finished_at)
+        loads = self.pool.load
+        busy = sum(load['busy'] for load in loads.values())
+        # One-at-a-time sends block the loop for their whole duration; with slots only the waits count
+        self.waits['sending'] = self.pool.slot_wait if self.pool.max_in_flight else busy
+        slots = self.pool.max_in_flight or 1
+        for label, load in sorted(loads.items()):
+            self.listener.on_status(
+                f"Dry run, {label}: {load['messages']} messages, {format_size(load['bytes'])}, "
+                f"busy {load['busy'] / (duration * slots) * 100 if duration else 0:.0f}% of the time")
+
+        attempts = sum(load['messages'] for load in loads.values())
+        retried = attempts - counts['success'] - counts['failed']
+        summary = (f"Dry run: {counts['success']} would be sent, {counts['failed']} would fail, "
+                   f"{counts['skipped']} skipped{self.resumed_summary()}")
+        if retried:
+            summary += f", {retried} retries"
+        summary += f". Projected duration {format_duration(duration)}"
+        if duration:
+            summary += f" ({counts['success'] / duration * 3600:.0f} messages/hour)"
+        cause = max(self.waits, key=self.waits.get)
+        if duration and self.waits[cause]:
+            summary += (f". Bottleneck: {self.WAIT_CAUSES[cause]}, {self.waits[cause] / duration * 100:.0f}% "
+                        f"of the time; {self.ADVICE[cause]}")
+        self.listener.on_finished(True, summary + '.')
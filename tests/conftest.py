@@ -0,0 +1,7 @@
+import os
+import sys
+
+# smscore and smscli live at the top of the repository, the stub SMTP server under benchmarks/
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
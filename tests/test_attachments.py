@@ -0,0 +1,16 @@
+import base64
+
+import pytest
+
+from smscore import encode_base64_lines, encoded_size
+
+
+@pytest.mark.parametrize('size', [0, 1, 2, 3, 56, 57, 58, 114, 1000, 57 * 4 + 1])
+def test_base64_lines_match_the_email_package(size):
+    data = bytes(range(256)) * (size // 256 + 1)
+    data = data[:size]
+    expected = base64.encodebytes(data).replace(b'\n', b'\r\n')
+    # A small chunk size makes the chunks join up into lines several times
+    assert encode_base64_lines(data, chunk_size=57 * 2) == expected
+    assert encode_base64_lines(memoryview(data)) == expected
+    assert encoded_size(size) == len(expected)
@@ -0,0 +1,51 @@
+import threading
+
+from smscore import CampaignListener, SimulatedCampaignSender
+
+
+class Recorder(CampaignListener):
+    def __init__(self):
+        self.finished = None
+
+    def on_finished(self, success, message):
+        self.finished = (success, message)
+
+
+def test_dry_run_with_concurrency_and_an_hourly_limit_finishes(tmp_path):
+    # Four sends in flight, a speed far above one server's 200/h: the run used to spin on the virtual clock
+    listener = Recorder()
+    sender = SimulatedCampaignSender(
+        smtp_details=[{'host': 'smtp.example.com', 'port': 587, 'username': 'u', 'password': 'p',
+                       'from_email': 'a@example.com', 'sender_name': 'A', 'max_per_hour': 200}],
+        message_text='Hi', leads=[f'lead{i}@example.com' for i in range(1000)], rotate_count=1, subject='Hello',
+        speed_value=100000, speed_unit='minute', attachments=[], max_in_flight=4,
+        suppression_path=str(tmp_path / 'suppression.db'), attachment_cache_path=str(tmp_path / 'cache'),
+        listener=listener)
+    thread = threading.Thread(target=sender.run, daemon=True)
+    thread.start()
+    thread.join(60)
+    assert not thread.is_alive(), f'dry run stuck at virtual time {sender.clock()}'
+    success, message = listener.finished
+    assert success, message
+    assert '1000 would be sent' in message
+    assert 5 * 3600 - 60 <= sender.clock() <= 5 * 3600
+
+
+def test_server_at_its_hourly_limit_does_not_hold_up_the_others(tmp_path):
+    listener = Recorder()
+    sender = SimulatedCampaignSender(
+        smtp_details=[{'host': 'limited.example.com', 'port': 587, 'username': 'limited', 'password': 'p',
+                       'from_email': 'a@example.com', 'sender_name': 'A', 'max_per_hour': 200},
+                      {'host': 'free.example.com', 'port': 587, 'username': 'free', 'password': 'p',
+                       'from_email': 'b@example.com', 'sender_name': 'B'}],
+        message_text='Hi', leads=[f'lead{i}@example.com' for i in range(1000)], rotate_count=1, subject='Hello',
+        speed_value=100000, speed_unit='minute', attachments=[],
+        suppression_path=str(tmp_path / 'suppression.db'), attachment_cache_path=str(tmp_path / 'cache'),
+        listener=listener)
+    sender.run()
+    success, message = listener.finished
+    assert success, message
+    # Strict rotation would pace both servers at the limited one's 200/h: 1000 leads in 2.5 hours
+    assert sender.clock() < 600
+    limited = next(load for label, load in sender.pool.load.items() if label.startswith('limited'))
+    assert limited['messages'] <= 200 * sender.clock() / 3600 + 1
@@ -0,0 +1,95 @@
+import time
+
+import pytest
+
+from smscore import CampaignListener, CampaignSender, CircuitBreaker, VirtualClock
+from stub_smtp import StubSMTPServer
+
+
+# Real sends to the stub servers; retry delays and circuit cooldowns pass on a virtual clock
+class VirtualTimeSender(CampaignSender):
+    def create_clock(self):
+        return VirtualClock()
+
+    def sleep(self, seconds):
+        self.clock.advance(seconds)
+
+
+class Recorder(CampaignListener):
+    def __init__(self):
+        self.entries = []
+        self.statuses = []
+        self.finished = None
+
+    def on_status(self, message):
+        self.statuses.append(message)
+
+    def on_log_batch(self, entries):
+        self.entries.extend(entries)
+
+    def on_finished(self, success, message):
+        self.finished = (success, message)
+
+
+@pytest.fixture
+def servers(tmp_path):
+    # One server defers a fifth of its recipients with 451, the other rejects every login
+    flaky = StubSMTPServer(errors={'RCPT': (0.2, 451)}, cert_dir=str(tmp_path), seed=7).start()
+    broken = StubSMTPServer(errors={'AUTH': (1.0, 535)}, cert_dir=str(tmp_path)).start()
+    yield flaky, broken
+    flaky.stop()
+    broken.stop()
+
+
+def smtp(server, name):
+    return {'host': '127.0.0.1', 'port': server.port, 'username': name, 'password': 'p',
+            'from_email': f'{name}@example.com', 'sender_name': name, 'max_per_hour': 0}
+
+
+def test_retries_transient_failures_and_routes_around_a_failing_server(servers, tmp_path):
+    flaky, broken = servers
+    leads = [f'lead{i}@example.com' for i in range(40)]
+    listener = Recorder()
+    sender = VirtualTimeSender(
+        smtp_details=[smtp(flaky, 'flaky'), smtp(broken, 'broken')], message_text='Hello', leads=leads,
+        rotate_count=1, subject='Test', speed_value=100000, speed_unit='minute', attachments=[],
+        suppression_path=str(tmp_path / 'suppression.db'), attachment_cache_path=str(tmp_path / 'cache'),
+        journal_path=str(tmp_path / 'run.journal'), listener=listener)
+    sender.run()
+
+    success, message = listener.finished
+    assert success, message
+    final = {entry['recipient']: entry for entry in listener.entries if entry['status'] != 'Deferred'}
+    deferred = [entry for entry in listener.entries if entry['status'] == 'Deferred']
+    assert sorted(final) == sorted(leads)
+    # 451s and the broken server's 535s are deferred and retried
+    assert flaky.stats['error_451'] > 0
+    assert any('451' in entry['message'] for entry in deferred)
+    assert any('535' in entry['message'] for entry in deferred)
+    assert all(entry['smtp'].startswith('flaky') for entry in final.values() if entry['status'] == 'Success')
+    # The broken server's circuit opened after five failed logins and its leads went to the flaky one
+    assert sender.scheduler.breakers[1].state == CircuitBreaker.OPEN
+    assert sender.scheduler.breakers[0].state == CircuitBreaker.CLOSED
+    assert any(status.startswith('broken (broken) taken out of rotation after 5 failures') for status in listener.statuses)
+    assert flaky.stats['messages'] == len(leads)
+
+
+def test_retry_and_breaker_options_reach_the_engine(servers, tmp_path):
+    # On the real clock: with the default minute of backoff this run would take minutes
+    flaky, _ = servers
+    leads = [f'lead{i}@example.com' for i in range(20)]
+    listener = Recorder()
+    sender = CampaignSender(
+        smtp_details=[smtp(flaky, 'flaky')], message_text='Hello', leads=leads, rotate_count=1, subject='Test',
+        speed_value=100000, speed_unit='minute', attachments=[], suppression_path=str(tmp_path / 'suppression.db'),
+        attachment_cache_path=str(tmp_path / 'cache'), journal_path=str(tmp_path / 'run.journal'), listener=listener,
+        retry_options={'base_delay': 0.01, 'max_delay': 0.05, 'max_attempts': 10},
+        breaker_options={'failure_threshold': 3, 'cooldown': 0.05})
+    started = time.monotonic()
+    sender.run()
+    assert time.monotonic() - started < 10
+    assert listener.finished[0], listener.finished[1]
+    assert flaky.stats['error_451'] > 0
+    assert flaky.stats['messages'] == len(leads)
+    assert sender.retries.max_attempts == 10
+    assert sender.scheduler.breakers[0].failure_threshold == 3
@@ -0,0 +1,33 @@
+from smscore import CampaignJournal
+
+
+def test_journal_resumes_and_ignores_a_torn_last_line(tmp_path):
+    path = str(tmp_path / 'run.journal')
+    journal = CampaignJournal(path, subject='Hello')
+    journal.record('Success', 'a@example.com')
+    journal.record('Failed', 'b@example.com')
+    journal.record('Skipped', 'c@example.com')
+    journal.close()
+    assert CampaignJournal.read_header(path)['subject'] == 'Hello'
+
+    # A crash mid-write leaves a last line without its newline
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('Success\td@exam')
+    journal = CampaignJournal(path)
+    assert journal.done == {'a@example.com', 'c@example.com'}
+    journal.record('Success', 'd@example.com')
+    journal.close()
+
+    journal = CampaignJournal(path)
+    assert journal.done == {'a@example.com', 'c@example.com', 'd@example.com'}
+    journal.close()
+
+
+def test_journal_torn_in_its_header_starts_over(tmp_path):
+    path = tmp_path / 'run.journal'
+    path.write_text('{"campaign": "run", "subj')
+    journal = CampaignJournal(str(path), subject='Hello')
+    journal.record('Success', 'a@example.com')
+    journal.close()
+    assert CampaignJournal.read_header(str(path))['subject'] == 'Hello'
+    assert CampaignJournal(str(path)).done == {'a@example.com'}
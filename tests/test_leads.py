@@ -0,0 +1,42 @@
+import os
+
+from smscore import LeadChecker, LeadSource, check_leads, gateway_registry, temporary_lead_files
+
+
+def test_lead_checker_counts_every_rejection():
+    gateway = sorted(gateway_registry.domains())[0]
+    checker = LeadChecker()
+    leads = ['a@example.com', 'A@Example.com ', 'not-an-email', f'5551234567@{gateway}',
+             '5551234567@unknown-carrier.example', '', 'b@example.com']
+    assert list(checker.iter_valid(leads)) == ['a@example.com', f'5551234567@{gateway}', 'b@example.com']
+    assert checker.stats == {'total': 6, 'accepted': 3, 'duplicates': 1, 'invalid': 1, 'unknown_gateway': 1,
+                             'missing_fields': 0}
+
+
+def test_lead_checker_drops_rows_missing_a_required_field():
+    checker = LeadChecker(required_fields=['name'])
+    records = [('a@example.com', {'name': 'Ann'}), ('b@example.com', {'name': ''}), ('c@example.com', None)]
+    assert [lead for lead, _ in checker.iter_valid_records(records)] == ['a@example.com']
+    assert checker.stats['missing_fields'] == 2
+
+
+def test_lead_checker_spills_to_disk_without_losing_duplicates():
+    checker = LeadChecker(max_in_memory=10)
+    leads = [f'user{i}@example.com' for i in range(50)] * 2
+    assert len(list(checker.iter_valid(leads))) == 50
+    assert checker.stats['duplicates'] == 50
+
+
+def test_checked_upload_is_a_temporary_file_deleted_by_discard(tmp_path):
+    upload = tmp_path / 'leads.txt'
+    upload.write_text('a@example.com\nbad\na@example.com\nb@example.com\n')
+    checked, stats = check_leads(LeadSource(str(upload)))
+    assert stats['accepted'] == 2
+    assert list(checked) == ['a@example.com', 'b@example.com']
+    assert checked.path in temporary_lead_files
+    checked.discard()
+    assert not os.path.exists(checked.path)
+    assert checked.path not in temporary_lead_files
+    # Uploaded files are never deleted
+    LeadSource(str(upload)).discard()
+    assert upload.exists()
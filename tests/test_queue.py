@@ -0,0 +1,28 @@
+from smscore import CampaignQueue
+
+
+def smtp_details():
+    return [{'host': 'h', 'port': 25, 'username': 'u', 'password': 'p', 'max_per_hour': 3600}]
+
+
+def test_campaign_run_outside_the_queue_shares_its_limits():
+    queue = CampaignQueue(smtp_details())
+    smtp, pool, single = queue.attach(100000, 'minute')
+    assert smtp == smtp_details()
+    assert single.limiter is queue.limiter
+    assert single.reserve(0) == 0
+    # Anything else sending through the account now waits for the hourly limit's next token
+    _, same_pool, other = queue.attach(100000, 'minute')
+    assert same_pool is pool
+    assert other.reserve(0) > 0
+
+
+def test_shared_pool_is_dropped_when_the_last_run_detaches():
+    queue = CampaignQueue(smtp_details())
+    _, _, first = queue.attach(60, 'minute')
+    _, _, second = queue.attach(60, 'minute')
+    queue.detach(first)
+    assert queue.pool is not None
+    queue.detach(second)
+    queue.detach(second)
+    assert queue.pool is None and queue.limiter is None
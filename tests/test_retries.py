@@ -0,0 +1,95 @@
+import random
+
+import pytest
+
+from smscore import RetryQueue, CircuitBreaker, SMTPScheduler, VirtualClock
+
+
+def test_retry_delays_back_off_with_equal_jitter():
+    random.seed(1)
+    retries = RetryQueue(base_delay=60, max_delay=900, max_attempts=10, clock=VirtualClock())
+    for attempt, (low, high) in enumerate([(30, 60), (60, 120), (120, 240), (240, 480), (450, 900), (450, 900)], 1):
+        for _ in range(20):
+            assert low <= retries.push('lead', attempt) <= high
+
+
+def test_retries_stop_after_max_attempts():
+    retries = RetryQueue(max_attempts=3, clock=VirtualClock())
+    assert retries.push('lead', 2) is not None
+    assert retries.push('lead', 3) is None
+    assert len(retries) == 1
+
+
+def test_retries_come_out_when_due_earliest_first():
+    clock = VirtualClock()
+    retries = RetryQueue(base_delay=10, max_attempts=5, clock=clock)
+    late = retries.push('late', 3)  # 20-40 s
+    early = retries.push('early', 1)  # 5-10 s
+    assert retries.pop_due() is None
+    assert retries.next_due() == pytest.approx(early)
+    clock.advance(early)
+    assert retries.pop_due() == ('early', 1)
+    assert retries.pop_due() is None
+    clock.advance(late)
+    assert retries.pop_due() == ('late', 3)
+    assert retries.next_due() is None
+
+
+def test_circuit_opens_after_threshold_and_probes_after_cooldown():
+    clock = VirtualClock()
+    breaker = CircuitBreaker(failure_threshold=3, cooldown=30, clock=clock)
+    assert not breaker.record_failure()
+    breaker.record_success()
+    assert not breaker.record_failure()
+    assert not breaker.record_failure()
+    assert breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.probe_due()
+    clock.advance(30)
+    assert breaker.probe_due()
+    breaker.probe_started()
+    breaker.probe_finished(True)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failures == 0
+
+
+def test_failed_probes_double_the_cooldown_then_give_up():
+    clock = VirtualClock()
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=30, max_cooldown=100, max_probes=3, clock=clock)
+    breaker.record_failure()
+    cooldowns = []
+    while breaker.state == CircuitBreaker.OPEN:
+        clock.advance_to(breaker.retry_at)
+        breaker.probe_started()
+        breaker.probe_finished(False)
+        cooldowns.append(breaker.cooldown)
+    assert cooldowns == [60, 100, 100]
+    assert breaker.state == CircuitBreaker.FAILED
+
+
+def test_scheduler_rotates_and_skips_open_circuits():
+    clock = VirtualClock()
+    scheduler = SMTPScheduler([{}, {}, {}], rotate_count=2, clock=clock)
+    assert [scheduler.pick() for _ in range(6)] == [0, 0, 1, 1, 2, 2]
+    scheduler.breakers[1].open()
+    assert [scheduler.pick() for _ in range(6)] == [0, 0, 2, 2, 2, 2]
+    scheduler.breakers[0].open()
+    scheduler.breakers[2].open()
+    assert scheduler.pick() is None
+    clock.advance(30)
+    assert scheduler.due_probes() == [0, 1, 2]
+    assert not scheduler.exhausted()
+    for breaker in scheduler.breakers:
+        breaker.state = CircuitBreaker.FAILED
+    assert scheduler.exhausted()
+
+
+def test_scheduler_passes_over_servers_held_by_their_rate_limit():
+    scheduler = SMTPScheduler([{}, {}, {}], rotate_count=1)
+    waits = {0: 5.0, 1: 0, 2: 0}
+    assert [scheduler.pick(waits.get) for _ in range(4)] == [1, 1, 2, 1]
+    # When every server would wait, the one ready soonest goes next
+    waits = {0: 5.0, 1: 2.0, 2: 3.0}
+    assert scheduler.pick(waits.get) == 1
+    scheduler.breakers[1].open()
+    assert scheduler.pick(waits.get) == 2
@@ -0,0 +1,58 @@
+import email
+import html
+
+from smscore import MergeTemplate, MessageTemplate
+
+
+def test_merge_fields_render_with_defaults():
+    template = MergeTemplate('Hi {{ First Name }}, your code is {{code|none}} {{missing}}!')
+    assert template.fields == {'first_name': None, 'code': 'none', 'missing': None}
+    assert template.render({'first_name': 'Ann', 'code': '42'}) == 'Hi Ann, your code is 42 !'
+    assert template.render({'first_name': 'Ann', 'code': ''}) == 'Hi Ann, your code is none !'
+
+
+def test_repeated_field_without_default_is_required():
+    template = MergeTemplate('{{name|friend}} and {{NAME}}')
+    assert template.fields == {'name': None}
+    assert template.render({'name': 'Bo'}) == 'Bo and Bo'
+
+
+def test_text_without_fields_is_returned_as_is():
+    template = MergeTemplate('No fields here')
+    assert template.placeholders == []
+    assert template.render(None) == 'No fields here'
+
+
+def test_escape_applies_to_lead_values_only():
+    template = MergeTemplate('<p>{{name|Friends & family}}</p>', escape=html.escape)
+    assert template.render({'name': 'Tom <Tom & Co>'}) == '<p>Tom &lt;Tom &amp; Co&gt;</p>'
+    assert template.render({}) == '<p>Friends & family</p>'
+
+
+def test_campaign_merge_fields_combine_subject_and_body():
+    assert MessageTemplate.merge_fields('Hi {{name|there}}', '{{name}} {{city|here}}') == {'name': None, 'city': 'here'}
+
+
+def parse(message):
+    parsed = email.message_from_bytes(message)
+    return parsed, parsed.get_payload()[0].get_payload(decode=True).decode('utf-8')
+
+
+def test_personalized_message_renders_subject_and_html_body():
+    template = MessageTemplate('Hello {{name}}', '<b>{{name}}</b> from {{city|town}}', [])
+    parsed, body = parse(template.render('from@example.com', 'to@example.com', {'name': 'A & B', 'city': ''}))
+    assert parsed['Subject'] == 'Hello A & B'
+    assert parsed['To'] == 'to@example.com'
+    assert body == '<b>A &amp; B</b> from town'
+
+
+def test_long_ascii_subject_is_not_folded():
+    template = MessageTemplate('x' * 200, 'body', [])
+    assert template.subject_header == b'Subject: ' + b'x' * 200 + b'\r\n'
+
+
+def test_non_ascii_subject_is_encoded():
+    template = MessageTemplate('Grüße', 'body', [])
+    parsed, _ = parse(template.render('from@example.com', 'to@example.com'))
+    assert template.subject_header.isascii()
+    assert str(email.header.make_header(email.header.decode_header(parsed['Subject']))) == 'Grüße'